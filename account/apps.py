@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class AccountConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'account'
+
+    def ready(self):
+        from account.authorization import token_cache
+        from config.utils.metrics import register_collector
+
+        def token_cache_metrics():
+            stats = token_cache.stats()
+            return [
+                ('auth_token_cache_hits_total', 'counter', 'Tokens found already verified', stats['hits']),
+                ('auth_token_cache_misses_total', 'counter', 'Tokens whose signature was checked', stats['misses']),
+                ('auth_token_cache_size', 'gauge', 'Verified tokens held', stats['size']),
+            ]
+
+        register_collector(token_cache_metrics)
@@ -1,4 +1,7 @@
-from datetime import timedelta
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -8,20 +11,90 @@ from ninja.security import HttpBearer
 User = get_user_model()
 
 TIME_DELTA = timedelta(days=120)
+TOKEN_CACHE_SIZE = 4096
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of tokens whose signature was already checked, entries are
+    dropped once the token's `exp` has passed
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is not None and entry[1] <= time.time():
+                del self._tokens[token]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._tokens.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, token, payload):
+        with self._lock:
+            self._tokens[token] = (payload, payload['exp'])
+            self._tokens.move_to_end(token)
+            if len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._tokens)}
+
+
+token_cache = VerifiedTokenCache()
+
 
 class GlobalAuth(HttpBearer):
     def authenticate(self, request, token):
-        try:
-            user_pk = jwt.decode(token=token, key=settings.SECRET_KEY, algorithms=['HS256'])
-        except JWTError:
-            return {'token': 'unauthorized'}
-        if user_pk:
-            return {'pk': str(user_pk['pk'])}
+        payload = token_cache.get(token)
+        if payload is None:
+            try:
+                payload = jwt.decode(token=token, key=settings.SECRET_KEY, algorithms=['HS256'],
+                                     options={'require_exp': True})
+            except JWTError:
+                return None
+            token_cache.set(token, payload)
+
+        return {'pk': str(payload['pk'])}
+
+
+class OptionalAuth(GlobalAuth):
+    """
+    Lets guests, requests without an Authorization header, through as
+    {'pk': None}; a token that does not verify is still answered with 401
+    """
+
+    def __call__(self, request):
+        if not request.headers.get(self.header):
+            return {'pk': None}
+        return super().__call__(request)
 
 
 def get_tokens_for_user(user):
-    token = jwt.encode({'pk': str(user.pk)}, key=settings.SECRET_KEY, algorithm='HS256')
+    issued_at = datetime.now(tz=timezone.utc)
+    token = jwt.encode({
+        'pk': str(user.pk),
+        'iat': issued_at,
+        'exp': issued_at + TIME_DELTA,
+    }, key=settings.SECRET_KEY, algorithm='HS256')
     return {
         'access': str(token),
     }
-
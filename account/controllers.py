@@ -4,6 +4,9 @@ from ninja import Router
 
 from account.authorization import GlobalAuth, get_tokens_for_user
 from account.schemas import AccountCreate, AuthOut, SigninSchema, AccountOut, AccountUpdate, ChangePasswordSchema
+from commerce.cart import read_anonymous_cart, merge_anonymous_cart, write_anonymous_cart
+from config.utils.executor import run_sync
+from config.utils.responses import render_json, json_response
 from config.utils.schemas import MessageOut
 
 User = get_user_model()
@@ -11,6 +14,23 @@ User = get_user_model()
 account_controller = Router(tags=['auth'])
 
 
+def auth_response(request, user, status=200):
+    """
+    Moves the guest cart, if any, into the user's cart and drops the cookie
+    """
+    cart = read_anonymous_cart(request)
+    merge_anonymous_cart(user.pk, cart)
+
+    content = render_json(AuthOut, {
+        'token': get_tokens_for_user(user),
+        'account': user,
+    })
+    response = json_response(content, status=status)
+    if cart:
+        write_anonymous_cart(response, {})
+    return response
+
+
 @account_controller.post('signup', response={
     400: MessageOut,
     201: AuthOut,
@@ -29,12 +49,7 @@ def signup(request, account_in: AccountCreate):
             password=account_in.password1
         )
 
-        token = get_tokens_for_user(new_user)
-
-        return 201, {
-            'token': token,
-            'account': new_user,
-        }
+        return auth_response(request, new_user, status=201)
 
     return 400, {'detail': 'User already registered!'}
 
@@ -49,17 +64,12 @@ def signin(request, signin_in: SigninSchema):
     if not user:
         return 404, {'detail': 'User does not exist'}
 
-    token = get_tokens_for_user(user)
-
-    return {
-        'token': token,
-        'account': user
-    }
+    return auth_response(request, user)
 
 
 @account_controller.get('', auth=GlobalAuth(), response=AccountOut)
-def me(request):
-    return get_object_or_404(User, id=request.auth['pk'])
+async def me(request):
+    return await run_sync(get_object_or_404, User, id=request.auth['pk'])
 
 
 @account_controller.put('', auth=GlobalAuth(), response={
@@ -1,3 +1,55 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from account import authorization
+from account.authorization import get_tokens_for_user, token_cache
+from account.models import User
+from commerce.models import Product
+
+
+@override_settings(ORM_WORKERS=0)
+class GlobalAuthTest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+
+    def me(self, token):
+        return self.client.get('/api/auth', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_verified_tokens_are_cached(self):
+        token = get_tokens_for_user(self.user)['access']
+
+        self.assertEqual(self.me(token).status_code, 200)
+        self.assertEqual(self.me(token).status_code, 200)
+        self.assertEqual(token_cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_invalid_token_is_rejected(self):
+        self.assertEqual(self.me('not-a-token').status_code, 401)
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_expired_token_is_rejected(self):
+        with mock.patch.object(authorization, 'TIME_DELTA', timedelta(seconds=-1)):
+            token = get_tokens_for_user(self.user)['access']
+
+        self.assertEqual(self.me(token).status_code, 401)
+
+    def test_bad_token_on_an_optional_endpoint_is_not_a_guest(self):
+        product = Product.objects.create(name='product', qty=1, cost=1, price=10, discounted_price=10,
+                                         is_featured=False, is_active=True)
+        with mock.patch.object(authorization, 'TIME_DELTA', timedelta(seconds=-1)):
+            expired = get_tokens_for_user(self.user)['access']
+
+        def add_to_cart(**headers):
+            return self.client.post('/api/orders/add-to-cart', {'product_id': str(product.id), 'item_qty': 1},
+                                    content_type='application/json', **headers)
+
+        for token in (expired, 'not-a-token'):
+            with self.subTest(token=token):
+                response = add_to_cart(HTTP_AUTHORIZATION=f'Bearer {token}')
+                self.assertEqual(response.status_code, 401)
+                self.assertNotIn('cart', response.cookies)
+
+        # no header at all is a guest
+        self.assertIn('cart', add_to_cart().cookies)
@@ -0,0 +1,242 @@
+"""
+Latency percentiles and SQL query counts for every route on config.urls.api,
+measured in process against a freshly seeded test database:
+
+    python -m benchmarks.endpoints --products 10000 --output results.json
+    python -m benchmarks.endpoints --budgets benchmarks/budgets.json --baseline previous.json
+    python -m benchmarks.endpoints --write-budgets benchmarks/budgets.json
+
+Each scenario runs --iterations times inside a transaction that is rolled back,
+so writes do not leak into the next run. The cache and the reference-data
+registry are cleared before the first run: `queries` is the cold count,
+`warm_queries` the count of the last run.
+The run fails (exit status 1) when a route has no scenario, answers 5xx, goes
+over a budget in --budgets, or its p95 grows past --tolerance x --baseline.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import asdict, fields
+from urllib.parse import urlencode
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+
+from account.authorization import get_tokens_for_user  # noqa: E402
+from benchmarks.seed import seed, Sizes, PASSWORD  # noqa: E402
+from commerce import registry  # noqa: E402
+from commerce.models import Item  # noqa: E402
+from config.urls import api  # noqa: E402
+
+TRANSACTION_SQL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def routes():
+    for prefix, router in api._routers:
+        for path, path_view in router.path_operations.items():
+            for operation in path_view.operations:
+                for method in operation.methods:
+                    yield f"{method} /api/{'/'.join(part for part in (prefix, path) if part)}"
+
+
+# route -> {variant: build(ctx) -> request}, a request being a dict of optional
+# path (format kwargs), params, body and auth
+SCENARIOS = {
+    'GET /api/products': {
+        '': lambda ctx: {},
+        'search': lambda ctx: {'params': {'q': 'red sh'}},
+        'category': lambda ctx: {'params': {'category': ctx['category'].id}},
+        'price, count': lambda ctx: {'params': {'price_from': 10, 'price_to': 50, 'with_count': True}},
+        'search, facets': lambda ctx: {'params': {'q': 'red sh', 'facets': True}},
+    },
+    'GET /api/products/export': {'': lambda ctx: {}},
+    'GET /api/products/categories': {'': lambda ctx: {}},
+    'GET /api/addresses': {'': lambda ctx: {}},
+    'GET /api/addresses/cities': {'': lambda ctx: {}},
+    'POST /api/addresses/cities': {'': lambda ctx: {'body': {'name': 'new city'}}},
+    'GET /api/addresses/cities/{id}': {'': lambda ctx: {'path': {'id': ctx['city'].id}}},
+    'PUT /api/addresses/cities/{id}': {'': lambda ctx: {'path': {'id': ctx['city'].id}, 'body': {'name': 'city'}}},
+    'DELETE /api/addresses/cities/{id}': {'': lambda ctx: {'path': {'id': ctx['city'].id}}},
+    'GET /api/vendors': {'': lambda ctx: {}},
+    'GET /api/orders/cart': {'': lambda ctx: {'auth': True}},
+    'POST /api/orders/add-to-cart': {
+        '': lambda ctx: {'auth': True, 'body': {'product_id': str(ctx['product'].id), 'item_qty': 1}},
+        'guest': lambda ctx: {'body': {'product_id': str(ctx['product'].id), 'item_qty': 1}},
+    },
+    'POST /api/orders/item/{id}/reduce-quantity': {'': lambda ctx: {'auth': True, 'path': {'id': cart_item(ctx)}}},
+    'DELETE /api/orders/item/{id}': {'': lambda ctx: {'auth': True, 'path': {'id': cart_item(ctx)}}},
+    'POST /api/orders/create-order': {'': lambda ctx: {'auth': True}},
+    'GET /api/orders': {'': lambda ctx: {'auth': True}},
+    'POST /api/auth/signup': {'': lambda ctx: {'body': {
+        'first_name': 'first', 'last_name': 'last', 'email': 'new@example.com',
+        'password1': PASSWORD, 'password2': PASSWORD,
+    }}},
+    'POST /api/auth/signin': {'': lambda ctx: {'body': {'email': ctx['user'].email, 'password': PASSWORD}}},
+    'GET /api/auth': {'': lambda ctx: {'auth': True}},
+    'PUT /api/auth': {'': lambda ctx: {'auth': True, 'body': {
+        'first_name': 'first', 'last_name': 'last', 'phone_number': None, 'address1': '', 'address2': '',
+        'company_name': '', 'company_website': '',
+    }}},
+    'POST /api/auth/change-password': {'': lambda ctx: {'auth': True, 'body': {
+        'old_password': PASSWORD, 'new_password1': PASSWORD, 'new_password2': PASSWORD,
+    }}},
+}
+
+
+def cart_item(ctx):
+    return Item.objects.filter(user=ctx['user'], ordered=False).values_list('id', flat=True).first()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(client, ctx, route, build, iterations):
+    method, path = route.split(' ', 1)
+    latencies, queries, statuses = [], [], set()
+
+    for i in range(iterations):
+        if i == 0:
+            cache.clear()
+            registry.invalidate_all()
+        with transaction.atomic():
+            request = build(ctx)
+            url = path.format(**request.get('path', {}))
+            if request.get('params'):
+                url += '?' + urlencode(request['params'])
+            headers = {'HTTP_AUTHORIZATION': f"Bearer {ctx['token']}"} if request.get('auth') else {}
+            body = json.dumps(request['body']) if 'body' in request else ''
+
+            with CaptureQueriesContext(connection) as ctx_queries:
+                started = time.perf_counter()
+                response = client.generic(method, url, body, content_type='application/json', **headers)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                latencies.append(time.perf_counter() - started)
+
+            queries.append(sum(1 for q in ctx_queries.captured_queries if not q['sql'].startswith(TRANSACTION_SQL)))
+            statuses.add(response.status_code)
+            transaction.set_rollback(True)
+
+    return {
+        'status': sorted(statuses),
+        'queries': queries[0],
+        'warm_queries': queries[-1],
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def check(results, budgets, baseline, tolerance):
+    failures = [f'{route}: no scenario' for route in results['unmeasured']]
+
+    for name, result in results['routes'].items():
+        if any(status >= 500 for status in result['status']):
+            failures.append(f'{name}: answered {result["status"]}')
+
+        for metric, limit in budgets.get(name, {}).items():
+            if result[metric] > limit:
+                failures.append(f'{name}: {metric} {result[metric]} > budget {limit}')
+
+        previous = baseline.get('routes', {}).get(name)
+        if previous and result['p95_ms'] > previous['p95_ms'] * tolerance:
+            failures.append(f'{name}: p95 {result["p95_ms"]}ms > {tolerance} x baseline {previous["p95_ms"]}ms')
+
+    return failures
+
+
+def run(sizes, iterations):
+    # queries are counted on this thread's connection
+    with override_settings(ORM_WORKERS=0, DEBUG=False):
+        data = seed(sizes)
+        user = data['users'][0]
+        in_cart = set(Item.objects.filter(user=user, ordered=False).values_list('product_id', flat=True))
+        ctx = {
+            'user': user,
+            'token': get_tokens_for_user(user)['access'],
+            'product': next(p for p in data['products'] if p.id not in in_cart),
+            'category': data['categories'][0],
+            'city': data['cities'][0],
+        }
+
+        client = Client()
+        results, unmeasured = {}, []
+        for route in routes():
+            if route not in SCENARIOS:
+                unmeasured.append(route)
+                continue
+            for variant, build in SCENARIOS[route].items():
+                name = f'{route} [{variant}]' if variant else route
+                results[name] = measure(client, ctx, route, build, iterations)
+                print(f'{name:60} {json.dumps(results[name])}', file=sys.stderr)
+
+    return {
+        'dataset': asdict(sizes),
+        'iterations': iterations,
+        'routes': results,
+        'unmeasured': unmeasured,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for field in fields(Sizes):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=int, default=field.default)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--budgets', help='JSON {route: {metric: max}}')
+    parser.add_argument('--baseline', help='results of a previous run to compare p95 against')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--write-budgets', help='write the query counts of this run as budgets')
+    args = parser.parse_args()
+
+    sizes = Sizes(**{field.name: getattr(args, field.name) for field in fields(Sizes)})
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run(sizes, args.iterations)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.write_budgets:
+        with open(args.write_budgets, 'w') as f:
+            json.dump({
+                name: {'queries': result['queries'], 'warm_queries': result['warm_queries']}
+                for name, result in results['routes'].items()
+            }, f, indent=2, sort_keys=True)
+
+    budgets, baseline = {}, {}
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets = json.load(f)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check(results, budgets, baseline, args.tolerance)
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Load generator comparing deployments of the API at high connection counts, e.g.
+
+    export MEMCACHED_LOCATION=127.0.0.1:11211  # one catalog cache for all the workers
+    gunicorn config.wsgi -w 4 --threads 8 -b 127.0.0.1:8001
+    uvicorn config.asgi:application --workers 4 --port 8002
+
+    python benchmarks/load.py http://127.0.0.1:8001 http://127.0.0.1:8002 \\
+        --connections 2000 --duration 30 --think 0.5
+
+Each connection is a keep-alive HTTP/1.1 client that cycles through --path and
+waits --think seconds between requests, the way a slow mobile client holds a
+socket open without using it. Only the standard library is needed.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = ['/api/products', '/api/vendors', '/api/addresses/cities']
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def report(self, duration):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            'requests': len(latencies),
+            'throughput': round(len(latencies) / duration, 1),
+            'errors': self.errors,
+            'statuses': self.statuses,
+            'mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+
+    length, chunked, close = 0, False, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding':
+            chunked = 'chunked' in value
+        elif name == 'connection':
+            close = value == 'close'
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif length:
+        await reader.readexactly(length)
+
+    return status, close
+
+
+async def client(url, paths, deadline, think, stats):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    requests = [
+        f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: application/json\r\n\r\n'.encode()
+        for path in paths
+    ]
+
+    writer = None
+    index = 0
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.monotonic()
+            writer.write(requests[index % len(requests)])
+            await writer.drain()
+            status, close = await read_response(reader)
+            stats.latencies.append(time.monotonic() - started)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            stats.errors += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+        index += 1
+        if think:
+            await asyncio.sleep(think)
+
+    if writer is not None:
+        writer.close()
+
+
+async def run(url, connections, duration, think, paths):
+    stats = Stats()
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(*[client(url, paths, deadline, think, stats) for _ in range(connections)])
+    return stats.report(time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('urls', nargs='+', help='base url of each deployment to compare')
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--think', type=float, default=0, help='idle seconds between requests on a connection')
+    parser.add_argument('--path', action='append', dest='paths', help=f'defaults to {DEFAULT_PATHS}')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for url in args.urls:
+        results[url] = asyncio.run(run(url, args.connections, args.duration, args.think, args.paths or DEFAULT_PATHS))
+        print(url, json.dumps(results[url]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Synthetic catalog, users, carts and orders for the benchmarks. Rows are bulk
+inserted, so the search index is rebuilt at the end instead of by the signals.
+"""
+import random
+import string
+from dataclasses import dataclass
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from account.models import User
+from commerce import search
+from commerce.models import Product, Vendor, Category, Label, Merchant, Item, Order, OrderStatus, City, Address, \
+    order_line
+
+PASSWORD = 'benchmark-password'
+WORDS = ['red', 'blue', 'green', 'cotton', 'leather', 'classic', 'slim', 'sport', 'summer', 'winter',
+         'shirt', 'shoe', 'bag', 'watch', 'jacket', 'dress', 'phone', 'case', 'lamp', 'chair']
+
+
+@dataclass
+class Sizes:
+    products: int = 2000
+    vendors: int = 20
+    categories: int = 30
+    labels: int = 5
+    merchants: int = 10
+    cities: int = 10
+    users: int = 50
+    cart_size: int = 5
+    orders_per_user: int = 3
+
+
+def _name(rng, words=3):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+@transaction.atomic
+def seed(sizes=Sizes(), random_seed=0):
+    rng = random.Random(random_seed)
+
+    vendors = Vendor.objects.bulk_create([
+        Vendor(name=f'vendor {i}', image=f'vendor/vendor-{i}.png') for i in range(sizes.vendors)
+    ])
+    labels = Label.objects.bulk_create([Label(name=f'label {i}') for i in range(sizes.labels)])
+    merchants = Merchant.objects.bulk_create([Merchant(name=f'merchant {i}') for i in range(sizes.merchants)])
+
+    # saved one by one so each gets its materialized path, roots first
+    categories = []
+    for i in range(sizes.categories):
+        parent = rng.choice(categories) if categories and i % 3 else None
+        categories.append(Category.objects.create(
+            parent=parent, name=f'category {i}', description='', image=f'category/category-{i}.png',
+            is_active=True,
+        ))
+
+    products = Product.objects.bulk_create([
+        Product(
+            name=_name(rng), description=_name(rng, 12), qty=10 ** 6, cost=10,
+            price=100, discounted_price=rng.randint(1, 100), vendor=rng.choice(vendors),
+            category=rng.choice(categories), label=rng.choice(labels), merchant=rng.choice(merchants),
+            is_featured=False, is_active=True,
+        )
+        for _ in range(sizes.products)
+    ], batch_size=1000)
+    search.rebuild_index()
+
+    cities = City.objects.bulk_create([City(name=f'city {i}') for i in range(sizes.cities)])
+
+    password = make_password(PASSWORD)
+    users = User.objects.bulk_create([
+        User(email=f'user{i}@example.com', first_name='first', last_name='last', password=password)
+        for i in range(sizes.users)
+    ])
+    Address.objects.bulk_create([
+        Address(user=user, address1='address', city=rng.choice(cities), phone='0000') for user in users
+    ])
+
+    status = OrderStatus.objects.create(title=OrderStatus.NEW, is_default=True)
+    carts, ordered, orders = [], [], []
+    for user in users:
+        picked = rng.sample(products, min(len(products), sizes.cart_size * (sizes.orders_per_user + 1)))
+        carts += [Item(user=user, product=p, item_qty=2) for p in picked[:sizes.cart_size]]
+        for n in range(sizes.orders_per_user):
+            lines = picked[sizes.cart_size * (n + 1):sizes.cart_size * (n + 2)]
+            items = [Item(user=user, product=p, item_qty=1, ordered=True) for p in lines]
+            ordered.append(items)
+            orders.append(Order(
+                user=user, status=status, ordered=True, total=sum(p.discounted_price for p in lines),
+                ref_code=''.join(rng.choices(string.ascii_letters, k=6)),
+                lines=[order_line(p.id, p.name, p.discounted_price, 1) for p in lines],
+            ))
+
+    Item.objects.bulk_create(carts, batch_size=1000)
+    Item.objects.bulk_create([item for items in ordered for item in items], batch_size=1000)
+    Order.objects.bulk_create(orders, batch_size=1000)
+    Order.items.through.objects.bulk_create([
+        Order.items.through(order_id=order.id, item_id=item.id)
+        for order, items in zip(orders, ordered) for item in items
+    ], batch_size=1000)
+
+    return {
+        'users': users,
+        'products': products,
+        'categories': categories,
+        'cities': cities,
+    }
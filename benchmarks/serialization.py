@@ -0,0 +1,99 @@
+"""
+Time to turn a list of products into ProductOut JSON, by response path:
+
+    python -m benchmarks.serialization --rows 10000 --repeat 5
+
+    ninja      model instances, pydantic validation, NinjaJSONEncoder (Ninja's defaults)
+    validated  model instances, pydantic validation, config.utils.renderers.dumps (render_json)
+    trusted    .values() rows shaped by commerce.export.product_row, dumps (render_trusted)
+
+Each path is timed from the query to the JSON string, against a freshly seeded
+test database; all three must produce the same document.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import List
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from ninja.responses import NinjaJSONEncoder  # noqa: E402
+from pydantic import parse_obj_as  # noqa: E402
+
+from benchmarks.seed import seed, Sizes  # noqa: E402
+from commerce.export import PRODUCT_VALUES, product_row  # noqa: E402
+from commerce.models import Product  # noqa: E402
+from commerce.schemas import ProductOut  # noqa: E402
+from config.utils.responses import render_json, render_trusted  # noqa: E402
+
+
+def products():
+    return Product.objects.filter(is_active=True).order_by('-created', '-id')
+
+
+def ninja():
+    instances = list(products().select_related('vendor', 'category', 'label', 'merchant'))
+    return json.dumps(parse_obj_as(List[ProductOut], instances), cls=NinjaJSONEncoder)
+
+
+def validated():
+    return render_json(List[ProductOut], list(products().select_related('vendor', 'category', 'label', 'merchant')))
+
+
+def trusted():
+    return render_trusted([product_row(row) for row in products().values(*PRODUCT_VALUES)])
+
+
+PATHS = {'ninja': ninja, 'validated': validated, 'trusted': trusted}
+
+
+def run(rows, repeat):
+    seed(Sizes(products=rows, users=1, orders_per_user=0))
+
+    documents = {name: json.loads(path()) for name, path in PATHS.items()}
+    assert len(documents['ninja']) == rows
+    for name, document in documents.items():
+        assert document == documents['ninja'], f'{name} differs from ninja'
+
+    results = {}
+    for name, path in PATHS.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            path()
+            timings.append(time.perf_counter() - started)
+        results[name] = {
+            'min_ms': round(min(timings) * 1000, 1),
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+        }
+    for name, result in results.items():
+        result['speedup'] = round(results['ninja']['median_ms'] / result['median_ms'], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run(args.rows, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    for name, result in results.items():
+        print(f'{name:<10}', json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
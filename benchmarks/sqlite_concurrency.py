@@ -0,0 +1,132 @@
+"""
+Reader/writer throughput of the SQLite profile against stock settings:
+
+    python -m benchmarks.sqlite_concurrency --readers 8 --writers 4 --duration 10
+
+Each profile runs in its own process on a fresh database file: `stock` is
+SQLite's defaults with a connection per operation, `tuned` is SQLITE_PRAGMAS and
+CONN_MAX_AGE from config.settings. Readers page through the catalog and a cart,
+writers add to carts. Every operation ends the way a request does, with
+close_old_connections().
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = ('stock', 'tuned')
+
+
+def run_profile(profile, readers, writers, duration, products):
+    import django
+    from django.conf import settings
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'db.sqlite3')
+    if profile == 'stock':
+        settings.SQLITE_PRAGMAS = {}
+        settings.DATABASES['default']['CONN_MAX_AGE'] = 0
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import close_old_connections, transaction, OperationalError
+    from django.db.models import F
+
+    from benchmarks.seed import seed, Sizes
+    from commerce.cart import get_cart
+    from commerce.models import Product, Item
+
+    call_command('migrate', verbosity=0)
+    data = seed(Sizes(products=products, users=max(writers, readers) * 4, orders_per_user=0))
+    user_ids = [user.id for user in data['users']]
+    product_ids = [product.id for product in data['products']]
+    close_old_connections()
+
+    def read(rng):
+        list(Product.objects.filter(is_active=True).select_related('vendor', 'category')
+             .order_by('-created', '-id')[:20])
+        get_cart(rng.choice(user_ids))
+
+    def write(rng):
+        user_id, product_id = rng.choice(user_ids), rng.choice(product_ids)
+        with transaction.atomic():
+            line = Item.objects.filter(user_id=user_id, product_id=product_id, ordered=False)
+            if not line.update(item_qty=F('item_qty') + 1):
+                Item.objects.create(user_id=user_id, product_id=product_id, item_qty=1)
+
+    results = {'reader': [], 'writer': []}
+    errors = {'reader': 0, 'writer': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(kind, operation, worker_seed):
+        rng = random.Random(worker_seed)
+        latencies, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                operation(rng)
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                failed += 1
+            finally:
+                close_old_connections()
+        with lock:
+            results[kind] += latencies
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=('reader', read, i)) for i in range(readers)]
+    threads += [threading.Thread(target=worker, args=('writer', write, readers + i)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    report = {}
+    for kind, latencies in results.items():
+        latencies.sort()
+        report[kind] = {
+            'ops_per_second': round(len(latencies) / duration, 1),
+            'errors': errors[kind],
+            'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+            'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--profile', choices=PROFILES, help='run a single profile in this process')
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(run_profile(args.profile, args.readers, args.writers, args.duration, args.products)))
+        return
+
+    results = {}
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_concurrency', '--profile', profile,
+             '--readers', str(args.readers), '--writers', str(args.writers),
+             '--duration', str(args.duration), '--products', str(args.products)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[profile] = json.loads(output.splitlines()[-1])
+        print(profile, json.dumps(results[profile]))
+
+
+if __name__ == '__main__':
+    main()
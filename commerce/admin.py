@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from commerce.models import Product, Order, Item, Address, OrderStatus, ProductImage, City, Category, Vendor, Merchant, \
-    Label
+    Label, Reservation
 
 admin.site.register(Product)
 admin.site.register(Order)
@@ -13,4 +13,5 @@ admin.site.register(City)
 admin.site.register(Category)
 admin.site.register(Vendor)
 admin.site.register(Merchant)
-admin.site.register(Label)
\ No newline at end of file
+admin.site.register(Label)
+admin.site.register(Reservation)
\ No newline at end of file
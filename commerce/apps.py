@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CommerceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'commerce'
+
+    def ready(self):
+        from commerce import signals  # noqa: F401
+        # before the first connection is opened
+        from config.utils import sqlite  # noqa: F401
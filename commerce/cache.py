@@ -0,0 +1,56 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from commerce import registry
+
+VERSION_KEY = 'catalog:version'
+# a version bump made by another process never reaches a per-process cache, its
+# entries expire as soon as the registry's snapshots do
+PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+TIMEOUT = registry.TTL if settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_BACKENDS else 60 * 15
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # a clock based start never collides with a version evicted from the cache
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def _stock_key(product_id):
+    return f'catalog:stock:{product_id}'
+
+
+def stock_changed(product_ids):
+    """
+    Stamps the stock of `product_ids` as changed. Unlike bump_catalog_version()
+    it only makes stale the cached pages that hold one of these products, see
+    stock_changed_since(), so a checkout does not flush the whole catalog.
+    """
+    now = time.time_ns()
+    # a page is never cached longer than TIMEOUT, an older stamp cannot matter
+    cache.set_many({_stock_key(product_id): now for product_id in product_ids}, TIMEOUT)
+
+
+def stock_changed_since(product_ids, since):
+    stamps = cache.get_many([_stock_key(product_id) for product_id in product_ids])
+    return any(stamp >= since for stamp in stamps.values())
+
+
+def catalog_cache_key(name, **params):
+    normalized = json.dumps({k: v for k, v in params.items() if v is not None}, sort_keys=True, default=str)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()
+    return f'catalog:{catalog_version()}:{name}:{digest}'
@@ -0,0 +1,175 @@
+import json
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum, F, OuterRef, Subquery
+from django.utils import timezone
+
+from commerce.models import Item, Product, LINE_TOTAL, ITEMS_TOTAL
+
+# bounds of the quantity a single add-to-cart may add, a negative one would
+# shrink the order total and grow the stock
+MAX_ITEM_QTY = 100
+
+
+def open_items(user_id):
+    return Item.objects.filter(user_id=user_id, ordered=False)
+
+
+def add_to_cart(user_id, product_id, qty):
+    """
+    Adds `qty` to the user's open line of the product, creating the line when
+    there is none. Returns False when the product does not exist or is not
+    active, like the guest cart.
+    """
+    # the product check and the user's open line in one query
+    found = list(
+        Product.objects.filter(id=product_id, is_active=True)
+        .annotate(line_id=Subquery(open_items(user_id).filter(product_id=OuterRef('id')).values('id')[:1]))
+        .values_list('line_id', flat=True)[:1]
+    )
+    if not found:
+        return False
+    if found[0] is None or not _increment(open_items(user_id).filter(id=found[0]), qty):
+        _create_line(user_id, product_id, qty)
+    return True
+
+
+def _increment(open_line, qty):
+    """
+    The increment is done by the database, so concurrent adds are never lost
+    """
+    return open_line.update(item_qty=F('item_qty') + qty, updated=timezone.now())
+
+
+def _create_line(user_id, product_id, qty):
+    try:
+        with transaction.atomic():
+            Item.objects.create(user_id=user_id, product_id=product_id, item_qty=qty)
+    except IntegrityError:
+        # a concurrent request created the line first
+        _increment(open_items(user_id).filter(product_id=product_id), qty)
+
+
+def cart_lines(user_id):
+    """
+    The cart lines with their product and its relations in one joined query,
+    each line annotated with its `line_total`
+    """
+    return (
+        open_items(user_id)
+        .select_related('product__vendor', 'product__label', 'product__merchant', 'product__category')
+        .annotate(line_total=LINE_TOTAL)
+        .order_by('created', 'id')
+    )
+
+
+def cart_summary(user_id):
+    return open_items(user_id).aggregate(
+        subtotal=ITEMS_TOTAL,
+        item_count=Sum('item_qty'),
+        lines=Count('id'),
+    )
+
+
+def get_cart(user_id):
+    summary = cart_summary(user_id)
+    if not summary['lines']:
+        return None
+
+    return {
+        'items': list(cart_lines(user_id)),
+        'subtotal': summary['subtotal'],
+        'item_count': summary['item_count'],
+    }
+
+
+# Guest carts live in a signed cookie, {product id hex: qty}, and cost no write until
+# the guest signs in or up, when merge_anonymous_cart() moves them into Item rows.
+ANONYMOUS_CART_COOKIE = 'cart'
+ANONYMOUS_CART_SALT = 'commerce.cart'
+ANONYMOUS_CART_MAX_AGE = 60 * 60 * 24 * 30
+# keeps the cookie well under the 4KB browsers accept
+ANONYMOUS_CART_MAX_LINES = 50
+PRODUCT_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def read_anonymous_cart(request):
+    raw = request.get_signed_cookie(ANONYMOUS_CART_COOKIE, default=None, salt=ANONYMOUS_CART_SALT,
+                                    max_age=ANONYMOUS_CART_MAX_AGE)
+    try:
+        cart = json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+    if not isinstance(cart, dict):
+        return {}
+    return {
+        product_id: qty for product_id, qty in cart.items()
+        if PRODUCT_ID_RE.match(product_id) and isinstance(qty, int) and qty > 0
+    }
+
+
+def write_anonymous_cart(response, cart):
+    if not cart:
+        response.delete_cookie(ANONYMOUS_CART_COOKIE)
+        return response
+    response.set_signed_cookie(ANONYMOUS_CART_COOKIE, json.dumps(cart, separators=(',', ':')),
+                               salt=ANONYMOUS_CART_SALT, max_age=ANONYMOUS_CART_MAX_AGE, httponly=True,
+                               samesite='Lax')
+    return response
+
+
+def add_to_anonymous_cart(cart, product_id, qty):
+    """
+    Returns False when the cart is full
+    """
+    key = product_id.hex
+    if key not in cart and len(cart) >= ANONYMOUS_CART_MAX_LINES:
+        return False
+    cart[key] = cart.get(key, 0) + qty
+    return True
+
+
+def get_anonymous_cart(cart):
+    if not cart:
+        return None
+
+    products = (
+        Product.objects.filter(id__in=list(cart), is_active=True)
+        .select_related('vendor', 'label', 'merchant', 'category')
+    )
+    items = [
+        {
+            'id': product.id,
+            'product': product,
+            'item_qty': cart[product.id.hex],
+            'ordered': False,
+            'line_total': product.discounted_price * cart[product.id.hex],
+        }
+        for product in products
+    ]
+    if not items:
+        return None
+
+    return {
+        'items': items,
+        'subtotal': sum(item['line_total'] for item in items),
+        'item_count': sum(item['item_qty'] for item in items),
+    }
+
+
+def merge_anonymous_cart(user_id, cart):
+    """
+    Folds a guest cart into the user's open cart like add_to_cart(), so a
+    concurrent add-to-cart is neither lost nor a collision. The products are
+    checked in one query, then at most two statements per line.
+    """
+    if not cart:
+        return
+
+    product_ids = Product.objects.filter(id__in=list(cart), is_active=True).values_list('id', flat=True)
+    with transaction.atomic():
+        for product_id in product_ids:
+            qty = cart[product_id.hex]
+            if not _increment(open_items(user_id).filter(product_id=product_id), qty):
+                _create_line(user_id, product_id, qty)
@@ -1,16 +1,33 @@
 import random
 import string
+import time
+from collections import defaultdict
 from typing import List
 
-from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from ninja import Router
 from pydantic import UUID4
 
-from account.authorization import GlobalAuth
-from commerce.models import Product, Category, City, Vendor, Item, Order, OrderStatus
-from commerce.schemas import ProductOut, CitiesOut, CitySchema, VendorOut, ItemOut, ItemSchema, ItemCreate
+from account.authorization import GlobalAuth, OptionalAuth
+from commerce import registry, stock
+from commerce.cache import catalog_cache_key, stock_changed_since, TIMEOUT as CATALOG_CACHE_TIMEOUT
+from commerce.cart import get_cart, open_items, read_anonymous_cart, write_anonymous_cart, add_to_anonymous_cart, \
+    get_anonymous_cart, add_to_cart, MAX_ITEM_QTY
+from commerce.export import export_ndjson, listing_row, CHUNK_SIZE, LISTING_VALUES
+from commerce.facets import cached_facets
+from commerce.models import Product, Category, City, Vendor, Item, Order, order_line
+from commerce.schemas import CategoryOut, CitiesOut, CitySchema, VendorOut, ItemCreate, ProductPageOut, CartOut, \
+    OrderPageOut
+from commerce.search import search_products
+from config.utils.executor import run_sync
+from config.utils.pagination import paginate, cached_count, InvalidCursor, DEFAULT_LIMIT, MAX_LIMIT
+from config.utils.responses import render_json, render_trusted, conditional_response, \
+    cached_conditional_response, cached_response, json_response
 from config.utils.schemas import MessageOut
 
 products_controller = Router(tags=['products'])
@@ -18,33 +35,69 @@ address_controller = Router(tags=['addresses'])
 vendor_controller = Router(tags=['vendors'])
 order_controller = Router(tags=['orders'])
 
-User = get_user_model()
+
+def vendors_response(request, key):
+    vendors_qs = Vendor.objects.all()
+    return cached_conditional_response(
+        request, key, vendors_qs,
+        lambda: render_json(List[VendorOut], list(vendors_qs)),
+        CATALOG_CACHE_TIMEOUT,
+    )
+
 
 @vendor_controller.get('', response=List[VendorOut])
-def list_vendors(request):
-    return Vendor.objects.all()
+async def list_vendors(request):
+    key = catalog_cache_key('vendors')
+    response = cached_response(request, key)
+    if response is None:
+        response = await run_sync(vendors_response, request, key)
+    return response
 
 
 @products_controller.get('', response={
-    200: List[ProductOut],
+    200: ProductPageOut,
+    400: MessageOut,
     404: MessageOut
 })
-def list_products(
+async def list_products(
         request, *,
         q: str = None,
         price_from: int = None,
         price_to: int = None,
-        vendor=None,
+        vendor: UUID4 = None,
+        category: UUID4 = None,
+        cursor: str = None,
+        limit: int = DEFAULT_LIMIT,
+        with_count: bool = False,
+        facets: bool = False,
 ):
-    products_qs = Product.objects.filter(is_active=True).select_related('merchant', 'vendor', 'category', 'label')
-
-    if not products_qs:
-        return 404, {'detail': 'No products found'}
-
+    limit = max(1, min(limit, MAX_LIMIT))
+    filters = dict(q=' '.join(q.lower().split()) if q else None, price_from=price_from, price_to=price_to,
+                   vendor=vendor, category=category)
+    key = catalog_cache_key('products', **filters, cursor=cursor, limit=limit, with_count=with_count, facets=facets)
+    # facets depend on the filter only, every page of a listing shares them
+    facets_key = catalog_cache_key('facets', **filters) if facets else None
+
+    # a cache hit is answered on the event loop, only a miss waits for an ORM thread
+    response = cached_response(request, key, page_is_stale)
+    if response is None:
+        response = await run_sync(products_response, request, key, q=q, price_from=price_from, price_to=price_to,
+                                  vendor=vendor, category=category, cursor=cursor, limit=limit,
+                                  with_count=with_count, facets_key=facets_key)
+    return response
+
+
+def products_response(request, key, *, q, price_from, price_to, vendor, category, cursor, limit, with_count,
+                      facets_key=None):
+    # taken before anything is read, stock that moves during the render makes the page stale
+    since = time.time_ns()
+    page_ids = []
+    products_qs = Product.objects.filter(is_active=True)
+
+    ordering = ('-created', '-id')
     if q:
-        products_qs = products_qs.filter(
-            Q(name__icontains=q) | Q(description__icontains=q)
-        )
+        products_qs = search_products(products_qs, q)
+        ordering = ('rank', 'id')
 
     if price_from:
         products_qs = products_qs.filter(discounted_price__gte=price_from)
@@ -55,7 +108,64 @@ def list_products(
     if vendor:
         products_qs = products_qs.filter(vendor_id=vendor)
 
-    return products_qs
+    if category:
+        root_path = Category.objects.filter(id=category).values_list('path', flat=True).first()
+        if root_path:
+            low, high = Category.subtree_range(root_path)
+            products_qs = products_qs.filter(
+                category_id__in=Category.objects.filter(path__gte=low, path__lt=high).values('id')
+            )
+        else:
+            products_qs = products_qs.none()
+
+    # plain rows rendered as they are (see render_trusted), labels and merchants
+    # come from the registry instead of two more joins
+    rows_qs = products_qs.values(*dict.fromkeys((*LISTING_VALUES, *(field.lstrip('-') for field in ordering))))
+
+    def render():
+        try:
+            page = paginate(rows_qs, cursor=cursor, limit=limit, ordering=ordering)
+        except InvalidCursor as e:
+            return 400, {'detail': str(e)}
+
+        if not page['items'] and not cursor:
+            return 404, {'detail': 'No products found'}
+
+        page_ids.extend(row['id'] for row in page['items'])
+        return render_trusted({
+            'items': [listing_row(row) for row in page['items']],
+            'next_cursor': page['next_cursor'],
+            'count': cached_count(products_qs) if with_count else None,
+            'facets': cached_facets(products_qs, facets_key, CATALOG_CACHE_TIMEOUT) if facets_key else None,
+        })
+
+    return cached_conditional_response(request, key, products_qs, render, CATALOG_CACHE_TIMEOUT,
+                                       is_stale=page_is_stale, dependencies=lambda: (since, page_ids))
+
+
+def page_is_stale(dependencies):
+    """
+    A checkout only drops the cached pages that hold one of its products,
+    see commerce.stock
+    """
+    since, product_ids = dependencies
+    return stock_changed_since(product_ids, since)
+
+
+@products_controller.get('export')
+def export_products(request, chunk_size: int = CHUNK_SIZE):
+    """
+    WSGI only: Django 3.2 iterates a streaming body on the ASGI event loop,
+    where the ORM refuses to run, and would fail after the 200 was sent
+    """
+    if isinstance(request, ASGIRequest):
+        return json_response(render_json(MessageOut, {'detail': 'The export is only served over WSGI'}), status=501)
+
+    products_qs = Product.objects.filter(is_active=True).order_by('-created', '-id')
+    return StreamingHttpResponse(
+        export_ndjson(products_qs, chunk_size=max(1, min(chunk_size, 10000))),
+        content_type='application/x-ndjson',
+    )
 
 
 """
@@ -119,30 +229,75 @@ def list_addresses(request):
     pass
 
 
-# @products_controller.get('categories', response=List[CategoryOut])
-# def list_categories(request):
-#     return Category.objects.all()
+@products_controller.get('categories', response=List[CategoryOut])
+def list_categories(request):
+    categories_qs = Category.objects.filter(is_active=True)
+
+    def render():
+        # parents sort before their children, so a single pass over the paths builds the tree
+        roots, nodes = [], {}
+        for category in categories_qs.order_by('path').values('id', 'name', 'description', 'image', 'path'):
+            node = {
+                'id': category['id'],
+                'name': category['name'],
+                'description': category['description'],
+                'image': default_storage.url(category['image']) if category['image'] else '',
+                'children': [],
+            }
+            parent_path = category['path'][:-(len(category['id'].hex) + 1)]
+            if not parent_path:
+                roots.append(node)
+            elif parent_path in nodes:
+                nodes[parent_path]['children'].append(node)
+            else:
+                # under an inactive category
+                continue
+            nodes[category['path']] = node
+
+        roots.sort(key=lambda node: node['name'])
+        for node in nodes.values():
+            node['children'].sort(key=lambda child: child['name'])
+
+        return render_json(List[CategoryOut], roots)
+
+    return cached_conditional_response(
+        request, catalog_cache_key('categories'), categories_qs, render, CATALOG_CACHE_TIMEOUT
+    )
 
 
 @address_controller.get('cities', response={
     200: List[CitiesOut],
     404: MessageOut
 })
-def list_cities(request):
-    cities_qs = City.objects.all()
+async def list_cities(request):
+    cities = registry.cities.current() or await run_sync(registry.cities.snapshot)
+
+    def render():
+        if cities.rows:
+            return render_json(List[CitiesOut], cities.rows)
 
-    if cities_qs:
-        return cities_qs
+        return 404, {'detail': 'No cities found'}
 
-    return 404, {'detail': 'No cities found'}
+    return conditional_response(request, cities.etag, render)
 
 
 @address_controller.get('cities/{id}', response={
     200: CitiesOut,
     404: MessageOut
 })
-def retrieve_city(request, id: UUID4):
-    return get_object_or_404(City, id=id)
+async def retrieve_city(request, id: UUID4):
+    cities = registry.cities.current()
+    city = cities.get(id) if cities else None
+    if city is None:
+        # loads the table, or looks up a city created by another process since
+        city = await run_sync(registry.cities.get, id)
+    if city is None:
+        return 404, {'detail': 'Not Found'}
+
+    return conditional_response(
+        request, f'"{city.id.hex}-{city.updated.timestamp()}"',
+        lambda: render_json(CitiesOut, city),
+    )
 
 
 @address_controller.post('cities', response={
@@ -175,39 +330,64 @@ def delete_city(request, id: UUID4):
     return 204, {'detail': ''}
 
 
-@order_controller.get('cart', response={
-    200: List[ItemOut],
+@order_controller.get('cart', auth=OptionalAuth(), response={
+    200: CartOut,
     404: MessageOut
 })
 def view_cart(request):
-    cart_items = Item.objects.filter(user=User.objects.first(), ordered=False)
+    if request.auth['pk']:
+        cart = get_cart(request.auth['pk'])
+    else:
+        cart = get_anonymous_cart(read_anonymous_cart(request))
 
-    if cart_items:
-        return cart_items
+    if cart:
+        return cart
 
     return 404, {'detail': 'Your cart is empty, go shop like crazy!'}
 
 
-@order_controller.post('add-to-cart', response={
+@order_controller.post('add-to-cart', auth=OptionalAuth(), response={
     200: MessageOut,
-    # 400: MessageOut
+    400: MessageOut,
+    404: MessageOut,
 })
 def add_update_cart(request, item_in: ItemCreate):
-    try:
-        item = Item.objects.get(product_id=item_in.product_id, user=User.objects.first())
-        item.item_qty += 1
-        item.save()
-    except Item.DoesNotExist:
-        Item.objects.create(**item_in.dict(), user=User.objects.first())
+    if not 1 <= item_in.item_qty <= MAX_ITEM_QTY:
+        return 400, {'detail': f'item_qty must be between 1 and {MAX_ITEM_QTY}'}
+
+    if not request.auth['pk']:
+        if not Product.objects.filter(id=item_in.product_id, is_active=True).exists():
+            return 404, {'detail': 'Product not found'}
+
+        cart = read_anonymous_cart(request)
+        if not add_to_anonymous_cart(cart, item_in.product_id, item_in.item_qty):
+            return 400, {'detail': 'Your cart is full, sign in to add more items'}
+
+        content = render_json(MessageOut, {'detail': 'Added to cart successfully'})
+        return write_anonymous_cart(json_response(content), cart)
+
+    if not add_to_cart(request.auth['pk'], item_in.product_id, item_in.item_qty):
+        return 404, {'detail': 'Product not found'}
 
     return 200, {'detail': 'Added to cart successfully'}
 
 
-@order_controller.post('item/{id}/reduce-quantity', response={
+@order_controller.post('item/{id}/reduce-quantity', auth=OptionalAuth(), response={
     200: MessageOut,
+    404: MessageOut,
 })
 def reduce_item_quantity(request, id: UUID4):
-    item = get_object_or_404(Item, id=id, user=User.objects.first())
+    if not request.auth['pk']:
+        # a guest cart line is identified by its product id
+        cart = read_anonymous_cart(request)
+        if id.hex not in cart:
+            return 404, {'detail': 'Not Found'}
+        cart[id.hex] -= 1
+        detail = 'Item quantity reduced successfully!' if cart[id.hex] else 'Item deleted!'
+        cart = {product_id: qty for product_id, qty in cart.items() if qty}
+        return write_anonymous_cart(json_response(render_json(MessageOut, {'detail': detail})), cart)
+
+    item = get_object_or_404(open_items(request.auth['pk']), id=id)
     if item.item_qty <= 1:
         item.delete()
         return 200, {'detail': 'Item deleted!'}
@@ -217,11 +397,19 @@ def reduce_item_quantity(request, id: UUID4):
     return 200, {'detail': 'Item quantity reduced successfully!'}
 
 
-@order_controller.delete('item/{id}', response={
-    204: MessageOut
+@order_controller.delete('item/{id}', auth=OptionalAuth(), response={
+    204: MessageOut,
+    404: MessageOut,
 })
 def delete_item(request, id: UUID4):
-    item = get_object_or_404(Item, id=id, user=User.objects.first())
+    if not request.auth['pk']:
+        cart = read_anonymous_cart(request)
+        if cart.pop(id.hex, None) is None:
+            return 404, {'detail': 'Not Found'}
+        content = render_json(MessageOut, {'detail': 'Item deleted!'})
+        return write_anonymous_cart(json_response(content, status=204), cart)
+
+    item = get_object_or_404(open_items(request.auth['pk']), id=id)
     item.delete()
 
     return 204, {'detail': 'Item deleted!'}
@@ -231,7 +419,10 @@ def generate_ref_code():
     return ''.join(random.sample(string.ascii_letters + string.digits, 6))
 
 
-@order_controller.post('create-order', auth=GlobalAuth(), response=MessageOut)
+@order_controller.post('create-order', auth=GlobalAuth(), response={
+    200: MessageOut,
+    400: MessageOut,
+})
 def create_order(request):
     '''
     * add items and mark (ordered) field as True
@@ -239,19 +430,77 @@ def create_order(request):
     * add NEW status
     * calculate the total
     '''
+    with transaction.atomic():
+        cart = list(open_items(request.auth['pk']).order_by('created', 'id').values_list(
+            'id', 'product_id', 'product__name', 'product__discounted_price', 'item_qty',
+        ))
+        if not cart:
+            return 400, {'detail': 'Your cart is empty, go shop like crazy!'}
+
+        item_ids = [item_id for item_id, *_ in cart]
+        lines = [order_line(*line) for _, *line in cart]
+        quantities = defaultdict(int)
+        for _, product_id, _, _, item_qty in cart:
+            quantities[product_id] += item_qty
+
+        order = Order.objects.create(
+            user_id=request.auth['pk'],
+            status=registry.order_statuses.default(),
+            ref_code=generate_ref_code(),
+            ordered=False,
+            total=sum(price * item_qty for _, _, _, price, item_qty in cart),
+            lines=lines,
+        )
 
-    order_qs = Order.objects.create(
-        user=User.objects.first(),
-        status=OrderStatus.objects.get(is_default=True),
-        ref_code=generate_ref_code(),
-        ordered=False,
-    )
+        try:
+            reserved = stock.reserve(order, quantities)
+        except ValueError as e:
+            # a cart line saved before add-to-cart checked the quantity
+            transaction.set_rollback(True)
+            return 400, {'detail': str(e)}
+        if not reserved:
+            transaction.set_rollback(True)
+            return 400, {'detail': 'Some items are out of stock'}
+
+        OrderItem = Order.items.through
+        OrderItem.objects.bulk_create([OrderItem(order_id=order.id, item_id=item_id) for item_id in item_ids])
+        ordered = Item.objects.filter(id__in=item_ids, ordered=False).update(ordered=True, updated=timezone.now())
+        if ordered != len(item_ids):
+            # a concurrent checkout ordered some of these lines first, its stock is already reserved
+            transaction.set_rollback(True)
+            return 400, {'detail': 'Your cart changed, please review it and try again'}
 
-    user_items = Item.objects.filter(user=User.objects.first()).filter(ordered=False)
+    return {'detail': 'order created successfully'}
 
-    order_qs.items.add(*user_items)
-    order_qs.total = order_qs.order_total
-    user_items.update(ordered=True)
-    order_qs.save()
 
-    return {'detail': 'order created successfully'}
+@order_controller.get('', auth=GlobalAuth(), response={
+    200: OrderPageOut,
+    400: MessageOut,
+})
+def list_orders(request, cursor: str = None, limit: int = DEFAULT_LIMIT):
+    """
+    Order history from the line snapshots, one query per page whatever the
+    catalog looks like today
+    """
+    orders_qs = (
+        Order.objects.filter(user_id=request.auth['pk'])
+        .only('id', 'ref_code', 'status', 'total', 'note', 'created', 'lines')
+    )
+    try:
+        page = paginate(orders_qs, cursor=cursor, limit=limit)
+    except InvalidCursor as e:
+        return 400, {'detail': str(e)}
+
+    page['items'] = [
+        {
+            'id': order.id,
+            'ref_code': order.ref_code,
+            'status': registry.order_statuses.get(order.status_id).title,
+            'total': order.total,
+            'note': order.note,
+            'created': order.created,
+            'lines': order.lines,
+        }
+        for order in page['items']
+    ]
+    return page
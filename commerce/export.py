@@ -0,0 +1,98 @@
+from functools import lru_cache
+
+from django.core.files.storage import default_storage
+
+from commerce import registry
+from commerce.renditions import rendition_urls
+from config.utils.renderers import dumps
+
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+PRODUCT_VALUES = (
+    'id', 'name', 'description', 'qty', 'price', 'discounted_price',
+    'vendor__id', 'vendor__name', 'vendor__image', 'vendor__image_hash',
+    'label__id', 'label__name',
+    'merchant__id', 'merchant__name',
+    'category__id', 'category__name', 'category__description', 'category__image',
+)
+
+# PRODUCT_VALUES without the label and merchant joins, see listing_row()
+LISTING_VALUES = tuple(
+    name for name in PRODUCT_VALUES if not name.startswith(('label__', 'merchant__'))
+) + ('label_id', 'merchant_id')
+
+
+# stored files are content addressed (config.utils.storage), the URL of a name
+# never changes, and a catalog has far fewer images than products
+@lru_cache(maxsize=4096)
+def _image_url(name):
+    return default_storage.url(name) if name else None
+
+
+_rendition_urls = lru_cache(maxsize=4096)(rendition_urls)
+
+
+def product_row(row):
+    """
+    Builds the ProductOut shape straight from a .values() row, without a model
+    instance, keys in the order ProductOut renders them
+    """
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'description': row['description'],
+        'qty': row['qty'],
+        'price': row['price'],
+        'discounted_price': row['discounted_price'],
+        'vendor': row['vendor__id'] and {
+            'id': row['vendor__id'],
+            'name': row['vendor__name'],
+            'image': _image_url(row['vendor__image']),
+            'renditions': _rendition_urls(row['vendor__image_hash']),
+        },
+        'category': row['category__id'] and {
+            'id': row['category__id'],
+            'name': row['category__name'],
+            'description': row['category__description'],
+            'image': _image_url(row['category__image']),
+        },
+        'label': row['label__id'] and {
+            'id': row['label__id'],
+            'name': row['label__name'],
+        },
+        'merchant': row['merchant__id'] and {
+            'id': row['merchant__id'],
+            'name': row['merchant__name'],
+        },
+    }
+
+
+def listing_row(row):
+    """
+    product_row() for a row read with LISTING_VALUES, the label and the merchant
+    come from the registry
+    """
+    label = registry.labels.get(row['label_id'])
+    merchant = registry.merchants.get(row['merchant_id'])
+    row['label__id'], row['label__name'] = (label.id, label.name) if label else (None, None)
+    row['merchant__id'], row['merchant__name'] = (merchant.id, merchant.name) if merchant else (None, None)
+    return product_row(row)
+
+
+def export_ndjson(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yields the products one JSON document per line. Rows are read `chunk_size`
+    at a time and lines are flushed in ~64KB blocks, memory stays flat
+    whatever the size of the catalog.
+    """
+    buffer, size = [], 0
+    for row in queryset.values(*PRODUCT_VALUES).iterator(chunk_size=chunk_size):
+        line = dumps(product_row(row)) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
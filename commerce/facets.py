@@ -0,0 +1,70 @@
+from django.core.cache import cache
+from django.db.models import Case, When, Value, Count, IntegerField
+
+from config.utils.routers import cache_timeout
+
+# lower bounds of the price buckets, the last one is open ended
+PRICE_BUCKETS = (0, 50, 100, 250, 500, 1000)
+
+
+def price_bucket():
+    """
+    Index in PRICE_BUCKETS of the bucket the discounted price falls in
+    """
+    return Case(
+        *[When(discounted_price__lt=high, then=Value(index))
+          for index, high in enumerate(PRICE_BUCKETS[1:])],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def facet_counts(queryset):
+    """
+    Product counts per vendor, per category and per price bucket of `queryset`,
+    from a single GROUP BY over the three, rolled up here. Only values with
+    products are listed, the most common first.
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket())
+        .values('vendor_id', 'vendor__name', 'category_id', 'category__name', 'price_bucket')
+        .annotate(count=Count('id'))
+    )
+
+    vendors, categories, prices = {}, {}, [0] * len(PRICE_BUCKETS)
+    for row in rows:
+        if row['vendor_id']:
+            vendor = vendors.setdefault(row['vendor_id'], {'id': row['vendor_id'], 'name': row['vendor__name'],
+                                                           'count': 0})
+            vendor['count'] += row['count']
+        if row['category_id']:
+            category = categories.setdefault(row['category_id'], {'id': row['category_id'],
+                                                                  'name': row['category__name'], 'count': 0})
+            category['count'] += row['count']
+        prices[row['price_bucket']] += row['count']
+
+    def by_count(values):
+        return sorted(values, key=lambda value: (-value['count'], value['name']))
+
+    return {
+        'vendors': by_count(vendors.values()),
+        'categories': by_count(categories.values()),
+        'prices': [
+            {'price_from': low, 'price_to': high, 'count': count}
+            for low, high, count in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + (None,), prices)
+            if count
+        ],
+    }
+
+
+def cached_facets(queryset, key, timeout):
+    """
+    facet_counts() cached under `key`, the filter without the page, so every
+    page of a listing shares one computation
+    """
+    facets = cache.get(key)
+    if facets is None:
+        facets = facet_counts(queryset)
+        cache.set(key, facets, cache_timeout(timeout))
+    return facets
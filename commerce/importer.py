@@ -0,0 +1,282 @@
+import csv
+import json
+import math
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from commerce import search
+from commerce.cache import bump_catalog_version
+from commerce.models import Product, Vendor, Category, Label, Merchant
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 20
+
+DECIMAL_FIELDS = ('qty', 'cost', 'price', 'discounted_price')
+FLOAT_FIELDS = ('weight', 'width', 'height', 'length')
+BOOLEAN_FIELDS = {'is_featured': False, 'is_active': True}
+TEXT_FIELDS = ('name', 'description')
+TRUE = {'1', 't', 'true', 'y', 'yes'}
+FALSE = {'0', 'f', 'false', 'n', 'no', ''}
+
+# relation -> (model, whether a missing name is created). Vendors and categories
+# carry images and descriptions the feed does not have, they come from the admin.
+RELATIONS = {
+    'vendor': (Vendor, False),
+    'category': (Category, False),
+    'label': (Label, True),
+    'merchant': (Merchant, True),
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    # (line number, message) of the first `max_errors` skipped rows, memory stays bounded on a bad feed
+    errors: list = field(default_factory=list)
+    max_errors: int = MAX_ERRORS
+
+    def skip(self, line_number, error):
+        self.skipped += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, error))
+
+
+def read_rows(stream, fmt):
+    """
+    Yields (line number, row dict) one at a time, the input is never held in memory
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f'invalid JSON: {e}')
+            continue
+        yield line_number, row
+
+
+class NameMap:
+    """
+    name -> id of a relation, loaded once. A name shared by several records is
+    ambiguous and rejected rather than guessed.
+    """
+
+    def __init__(self, model, create_missing):
+        self.model = model
+        self.create_missing = create_missing
+        self.ids = {}
+        self.ambiguous = set()
+        self.pending = {}
+        for pk, name in model.objects.values_list('pk', 'name').iterator():
+            if name in self.ids:
+                self.ambiguous.add(name)
+            self.ids[name] = pk
+
+    def resolve(self, name):
+        if name in (None, ''):
+            return None
+        name = str(name).strip()
+        if name in self.ambiguous:
+            raise RowError(f'{self.model._meta.verbose_name} "{name}" is ambiguous')
+        if name in self.ids:
+            return self.ids[name]
+        if name in self.pending:
+            return self.pending[name].pk
+        if not self.create_missing:
+            raise RowError(f'unknown {self.model._meta.verbose_name} "{name}"')
+        instance = self.pending[name] = self.model(name=name)
+        return instance.pk
+
+    def flush(self):
+        """
+        Inserts the names created since the last flush, before the products pointing at them
+        """
+        if self.pending:
+            self.model.objects.bulk_create(self.pending.values())
+            self.ids.update({name: instance.pk for name, instance in self.pending.items()})
+            self.pending = {}
+
+
+def _decimal(value, model_field):
+    """
+    Decimal rounded to the places of `model_field`, refused if it does not
+    fit its max_digits: the database would fail the whole batch on it
+    """
+    try:
+        number = Decimal(str(value).strip())
+        if not number.is_finite():
+            raise InvalidOperation
+        number = number.quantize(Decimal(1).scaleb(-model_field.decimal_places))
+    except InvalidOperation:
+        raise RowError(f'"{value}" is not a number')
+    if len(number.as_tuple().digits) > model_field.max_digits:
+        raise RowError(f'"{value}" is out of range')
+    return number
+
+
+def _float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'"{value}" is not a number')
+    if not math.isfinite(number):
+        raise RowError(f'"{value}" is not a number')
+    return number
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    raise RowError(f'"{value}" is not a boolean')
+
+
+def parse_row(row, name_maps):
+    """
+    Feed row -> Product field values, only the columns present in the feed
+    """
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('not an object')
+
+    sku = str(row.get('sku') or '').strip()
+    if not sku:
+        raise RowError('missing sku')
+
+    values = {'sku': sku}
+    for name in TEXT_FIELDS:
+        if name in row:
+            values[name] = row[name]
+    for name in DECIMAL_FIELDS:
+        if name in row:
+            values[name] = _decimal(row[name], Product._meta.get_field(name))
+    for name in FLOAT_FIELDS:
+        if row.get(name) not in (None, ''):
+            values[name] = _float(row[name])
+    for name in BOOLEAN_FIELDS:
+        if name in row:
+            values[name] = _bool(row[name])
+    for name, name_map in name_maps.items():
+        if name in row:
+            values[f'{name}_id'] = name_map.resolve(row[name])
+
+    if not values.get('name', True):
+        raise RowError('missing name')
+    return values
+
+
+def _update(products, fields):
+    """
+    bulk_update() without its CASE per column: a single UPDATE statement run
+    once per row through executemany, which costs a fraction of the CPU
+    """
+    connection = connections[router.db_for_write(Product)]
+    columns = [Product._meta.get_field(name) for name in (*fields, 'updated')]
+    pk = Product._meta.pk
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        connection.ops.quote_name(Product._meta.db_table),
+        ', '.join(f'{connection.ops.quote_name(column.column)} = %s' for column in columns),
+        connection.ops.quote_name(pk.column),
+    )
+    params = [
+        [column.get_db_prep_save(getattr(product, column.attname), connection) for column in columns]
+        + [pk.get_db_prep_value(product.pk, connection)]
+        for product in products
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def _write_batch(batch, name_maps, result):
+    """
+    Upserts one batch: one lookup of the existing skus, one bulk_create, an
+    update per set of columns and a re-index of the batch, in one transaction
+    """
+    with transaction.atomic():
+        for name_map in name_maps.values():
+            name_map.flush()
+
+        existing = dict(Product.objects.filter(sku__in=batch).values_list('sku', 'pk'))
+        to_create, to_update = [], {}
+        now = timezone.now()
+
+        for sku, (line_number, values) in batch.items():
+            if sku in existing:
+                # grouped by the columns they set, a row never blanks a column it does not have
+                fields = tuple(sorted(name for name in values if name != 'sku'))
+                to_update.setdefault(fields, []).append(Product(pk=existing[sku], updated=now, **values))
+                continue
+
+            missing = [name for name in ('name', *DECIMAL_FIELDS) if name not in values]
+            if missing:
+                result.skip(line_number, f'missing {", ".join(missing)}')
+                continue
+            to_create.append(Product(**{**BOOLEAN_FIELDS, **values}))
+
+        Product.objects.bulk_create(to_create)
+        updated = []
+        for fields, products in to_update.items():
+            _update(products, fields)
+            updated += products
+
+        search.index_products([product.pk for product in to_create + updated])
+        transaction.on_commit(bump_catalog_version)
+
+    result.created += len(to_create)
+    result.updated += len(updated)
+
+
+def import_products(rows, batch_size=BATCH_SIZE, on_batch=None, max_errors=MAX_ERRORS):
+    """
+    Creates or updates products from (line number, row) pairs, keyed on `sku`.
+    Rows that cannot be imported are counted in `skipped`, the first `max_errors`
+    kept in `errors`, and the rest goes on.
+    Model signals are bypassed, so the search index and the catalog cache
+    version are maintained here.
+    """
+    name_maps = {name: NameMap(model, create) for name, (model, create) in RELATIONS.items()}
+    result = ImportResult(max_errors=max_errors)
+    # keyed on sku, the last row of a sku in a batch wins
+    batch = {}
+
+    for line_number, row in rows:
+        try:
+            values = parse_row(row, name_maps)
+        except RowError as e:
+            result.skip(line_number, str(e))
+            continue
+
+        batch[values['sku']] = (line_number, values)
+        if len(batch) >= batch_size:
+            _write_batch(batch, name_maps, result)
+            batch = {}
+            if on_batch:
+                on_batch(result)
+
+    if batch:
+        _write_batch(batch, name_maps, result)
+        if on_batch:
+            on_batch(result)
+
+    return result
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from commerce import importer
+
+
+class Command(BaseCommand):
+    help = 'Creates or updates products from a CSV or JSONL feed, matched on sku'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="feed file, '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='defaults to the file extension, jsonl for stdin')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+        parser.add_argument('--max-errors', type=int, default=importer.MAX_ERRORS,
+                            help='errors to keep and print, all are counted')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'csv' if os.path.splitext(path)[1].lower() == '.csv' else 'jsonl'
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+        started = time.monotonic()
+
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{result.created + result.updated} products, {time.monotonic() - started:.1f}s')
+
+        with stream:
+            result = importer.import_products(importer.read_rows(stream, fmt), batch_size=options['batch_size'],
+                                              on_batch=progress, max_errors=options['max_errors'])
+
+        for line_number, error in result.errors:
+            self.stderr.write(f'line {line_number}: {error}')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created}, updated {result.updated}, skipped {result.skipped} in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from commerce import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text product search index from the product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=None, help='Database alias to rebuild the index on')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if using and not search.is_supported(using):
+            raise CommandError(f'Full-text search is not supported on "{using}"')
+
+        count = search.rebuild_index(using=using)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from commerce import stock
+
+
+class Command(BaseCommand):
+    help = 'Cancels NEW orders whose reservations expired and gives their stock back to the products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        released = stock.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} reservations'))
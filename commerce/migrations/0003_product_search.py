@@ -0,0 +1,57 @@
+# Generated by Django 3.2.8 on 2026-10-17 21:33
+
+import commerce.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS commerce_product_search USING fts5(
+    product_id UNINDEXED,
+    name,
+    description,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+POPULATE_INDEX = """
+INSERT INTO commerce_product_search (rowid, product_id, name, description)
+SELECT rowid, id, name, COALESCE(description, '') FROM commerce_product
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    schema_editor.execute(POPULATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS commerce_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0002_auto_20211027_1637'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(db_column='product_id', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='commerce.product')),
+                ('name', models.TextField(verbose_name='name')),
+                ('description', models.TextField(verbose_name='description')),
+                ('document', commerce.models.SearchDocumentField(db_column='commerce_product_search')),
+                ('rank', models.FloatField(verbose_name='rank')),
+            ],
+            options={
+                'db_table': 'commerce_product_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
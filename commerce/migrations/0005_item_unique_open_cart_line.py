@@ -0,0 +1,34 @@
+# Generated by Django 3.2.8 on 2026-10-17 21:36
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_cart_lines(apps, schema_editor):
+    Item = apps.get_model('commerce', 'Item')
+    duplicates = (
+        Item.objects.filter(ordered=False)
+        .values('user_id', 'product_id')
+        .annotate(lines=Count('id'), total_qty=Sum('item_qty'))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        lines = Item.objects.filter(ordered=False, user_id=duplicate['user_id'], product_id=duplicate['product_id'])
+        keep = lines.order_by('created').first()
+        lines.exclude(id=keep.id).delete()
+        Item.objects.filter(id=keep.id).update(item_qty=duplicate['total_qty'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0004_product_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user', 'product'), name='unique_open_cart_line'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.8 on 2026-10-17 21:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0005_item_unique_open_cart_line'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('qty', models.IntegerField(verbose_name='qty')),
+                ('expires', models.DateTimeField(db_index=True, verbose_name='expires')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='commerce.order', verbose_name='order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='commerce.product', verbose_name='product')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
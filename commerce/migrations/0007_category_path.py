@@ -0,0 +1,37 @@
+# Generated by Django 3.2.8 on 2026-10-17 21:39
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('commerce', 'Category')
+    level = list(Category.objects.filter(parent__isnull=True))
+    paths = {}
+    while level:
+        for category in level:
+            category.path = paths.get(category.parent_id, '') + f'{category.id.hex}/'
+            category.depth = category.path.count('/') - 1
+            paths[category.id] = category.path
+        Category.objects.bulk_update(level, ['path', 'depth'])
+        level = list(Category.objects.filter(parent_id__in=[category.id for category in level]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0006_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='depth'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1024, verbose_name='path'),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
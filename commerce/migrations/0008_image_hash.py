@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-17 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0007_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='image hash'),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='image hash'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.8 on 2026-10-17 21:56
+
+from django.db import migrations, models
+
+
+def snapshot_lines(apps, schema_editor):
+    """
+    Past orders only have their live items, snapshot them at today's prices.
+    The line shape is spelled out here, commerce.models.order_line() may change.
+    """
+    Order = apps.get_model('commerce', 'Order')
+    OrderItem = Order.items.through
+    lines = {}
+    rows = OrderItem.objects.values_list(
+        'order_id', 'item__product_id', 'item__product__name', 'item__product__discounted_price', 'item__item_qty',
+    )
+    for order_id, product_id, name, unit_price, qty in rows.iterator():
+        lines.setdefault(order_id, []).append({
+            'product_id': str(product_id),
+            'name': name,
+            'unit_price': str(unit_price),
+            'qty': qty,
+            'line_total': str(unit_price * qty),
+        })
+
+    orders = [Order(id=order_id, lines=order_lines) for order_id, order_lines in lines.items()]
+    Order.objects.bulk_update(orders, ['lines'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0009_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='lines',
+            field=models.JSONField(default=list, editable=False, verbose_name='lines'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created', '-id'], name='order_user_created_idx'),
+        ),
+        migrations.RunPython(snapshot_lines, migrations.RunPython.noop),
+    ]
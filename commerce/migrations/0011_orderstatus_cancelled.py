@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-17 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0010_order_lines'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderstatus',
+            name='title',
+            field=models.CharField(choices=[('NEW', 'NEW'), ('CANCELLED', 'CANCELLED'), ('PROCESSING', 'PROCESSING'), ('SHIPPED', 'SHIPPED'), ('COMPLETED', 'COMPLETED'), ('REFUNDED', 'REFUNDED')], max_length=255, verbose_name='title'),
+        ),
+    ]
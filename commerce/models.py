@@ -1,15 +1,26 @@
 import uuid
 
-from PIL import Image
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Concat, Substr
 
+from commerce.renditions import hash_upload, rendition_urls, schedule as schedule_renditions
 from config.utils.models import Entity
 
 User = get_user_model()
 
+# discounted_price * item_qty of an Item, and its SUM over an Item queryset, computed by the database
+LINE_TOTAL = models.ExpressionWrapper(
+    models.F('product__discounted_price') * models.F('item_qty'),
+    output_field=models.DecimalField(max_digits=1000, decimal_places=2),
+)
+ITEMS_TOTAL = models.Sum(LINE_TOTAL)
+
 
 class Product(Entity):
+    # stable key of the product in the supplier feed, see `manage.py import_products`
+    sku = models.CharField('sku', max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(verbose_name='name', max_length=255)
     description = models.TextField('description', null=True, blank=True)
     weight = models.FloatField('weight', null=True, blank=True)
@@ -36,10 +47,52 @@ class Product(Entity):
     label = models.ForeignKey('commerce.Label', verbose_name='label', related_name='products', null=True, blank=True,
                               on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # catalog listing, newest first
+            models.Index(fields=['-created', '-id'], condition=models.Q(is_active=True),
+                         name='product_active_created_idx'),
+            models.Index(fields=['is_active', 'discounted_price'], name='product_active_price_idx'),
+            models.Index(fields=['vendor', 'is_active', 'discounted_price'], name='product_vendor_active_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class SearchDocumentField(models.TextField):
+    """
+    FTS5 hidden column named after its table, used as the left side of MATCH
+    """
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class ProductSearch(models.Model):
+    """
+    Read side of the full-text index maintained by commerce.search,
+    the table itself is an FTS5 virtual table created by a migration
+    """
+    product = models.OneToOneField(Product, primary_key=True, db_column='product_id', related_name='search',
+                                   on_delete=models.DO_NOTHING)
+    name = models.TextField('name')
+    description = models.TextField('description')
+    document = SearchDocumentField(db_column='commerce_product_search')
+    rank = models.FloatField('rank')
+
+    class Meta:
+        managed = False
+        db_table = 'commerce_product_search'
+
+
 class Order(Entity):
     user = models.ForeignKey(User, verbose_name='user', related_name='orders', null=True, blank=True,
                              on_delete=models.CASCADE)
@@ -52,15 +105,34 @@ class Order(Entity):
     ref_code = models.CharField('ref code', max_length=255)
     ordered = models.BooleanField('ordered')
     items = models.ManyToManyField('commerce.Item', verbose_name='items', related_name='order')
+    # what was bought, frozen when the order is placed, see order_line()
+    lines = models.JSONField('lines', default=list, editable=False)
+
+    class Meta:
+        indexes = [
+            # order history, newest first
+            models.Index(fields=['user', '-created', '-id'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.first_name} + {self.total}'
 
     @property
     def order_total(self):
-        return sum(
-            i.product.discounted_price * i.item_qty for i in self.items.all()
-        )
+        return self.items.aggregate(total=ITEMS_TOTAL)['total'] or 0
+
+
+def order_line(product_id, name, unit_price, qty):
+    """
+    One entry of Order.lines, amounts as strings so they stay exact in JSON
+    """
+    return {
+        'product_id': str(product_id),
+        'name': name,
+        'unit_price': str(unit_price),
+        'qty': qty,
+        'line_total': str(unit_price * qty),
+    }
 
 
 class Item(Entity):
@@ -74,16 +146,40 @@ class Item(Entity):
     item_qty = models.IntegerField('item_qty')
     ordered = models.BooleanField('ordered', default=False)
 
+    class Meta:
+        constraints = [
+            # one open cart line per product, ordered lines are history
+            models.UniqueConstraint(fields=['user', 'product'], condition=models.Q(ordered=False),
+                                    name='unique_open_cart_line'),
+        ]
+
     def __str__(self):
         return self.product.name
 
 
+class Reservation(Entity):
+    """
+    Stock taken off Product.qty for an order, given back by
+    `manage.py release_expired_reservations` if the order is still NEW when it expires,
+    the order is then cancelled
+    """
+    order = models.ForeignKey('commerce.Order', verbose_name='order', related_name='reservations',
+                              on_delete=models.CASCADE)
+    product = models.ForeignKey('commerce.Product', verbose_name='product', related_name='reservations',
+                                on_delete=models.CASCADE)
+    qty = models.IntegerField('qty')
+    expires = models.DateTimeField('expires', db_index=True)
+
+    def __str__(self):
+        return f'{self.product_id} x {self.qty}'
+
+
 class OrderStatus(Entity):
     NEW = 'NEW'  # Order with reference created, items are in the basket.
     # CREATED = 'CREATED'  # Created with items and pending payment.
     # HOLD = 'HOLD'  # Stock reduced but still awaiting payment.
     # FAILED = 'FAILED'  # Payment failed, retry is available.
-    # CANCELLED = 'CANCELLED'  # Cancelled by seller, stock increased.
+    CANCELLED = 'CANCELLED'  # Cancelled by seller or unpaid when its reservation expired, stock increased.
     PROCESSING = 'PROCESSING'  # Payment confirmed, processing order.
     SHIPPED = 'SHIPPED'  # Shipped to customer.
     COMPLETED = 'COMPLETED'  # Completed and received by customer.
@@ -91,6 +187,7 @@ class OrderStatus(Entity):
 
     title = models.CharField('title', max_length=255, choices=[
         (NEW, NEW),
+        (CANCELLED, CANCELLED),
         (PROCESSING, PROCESSING),
         (SHIPPED, SHIPPED),
         (COMPLETED, COMPLETED),
@@ -113,7 +210,9 @@ class Category(Entity):
     description = models.TextField('description')
     image = models.ImageField('image', upload_to='category/')
     is_active = models.BooleanField('is active')
-
+    # materialized path, the hex ids from the root down to this category, each followed by '/'
+    path = models.CharField('path', max_length=1024, editable=False, db_index=True, default='')
+    depth = models.PositiveSmallIntegerField('depth', editable=False, default=0)
 
     def __str__(self):
         if self.parent:
@@ -124,9 +223,40 @@ class Category(Entity):
         verbose_name = 'category'
         verbose_name_plural = 'categories'
 
-    @property
-    def children(self):
-        return self.children
+    @staticmethod
+    def subtree_range(path):
+        """
+        Bounds of every path in the subtree rooted at `path` (itself included): the
+        subtree sorts between the path and the same path with its last '/' bumped to '0'
+        """
+        return path, path[:-1] + chr(ord(path[-1]) + 1)
+
+    def subtree(self):
+        low, high = self.subtree_range(self.path)
+        return Category.objects.filter(path__gte=low, path__lt=high)
+
+    def clean(self):
+        if self.parent_id and self.path and self.parent.path.startswith(self.path):
+            raise ValidationError({'parent': 'A category cannot be moved under itself'})
+
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        parent_path = self.parent.path if self.parent_id else ''
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError('A category cannot be moved under itself')
+
+        self.path = f'{parent_path}{self.id.hex}/'
+        self.depth = self.path.count('/') - 1
+        super().save(*args, **kwargs)
+
+        if old_path and old_path != self.path:
+            # moved, rewrite the prefix of every descendant in one statement
+            low, high = self.subtree_range(old_path)
+            Category.objects.filter(path__gte=low, path__lt=high).exclude(pk=self.pk).update(
+                path=Concat(models.Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=models.F('depth') + self.depth - (old_path.count('/') - 1),
+            )
+
 
 class Merchant(Entity):
     name = models.CharField('name', max_length=255)
@@ -140,20 +270,24 @@ class ProductImage(Entity):
     is_default_image = models.BooleanField('is default image')
     product = models.ForeignKey('commerce.Product', verbose_name='product', related_name='images',
                                 on_delete=models.CASCADE)
+    image_hash = models.CharField('image hash', max_length=64, blank=True, editable=False)
 
     def __str__(self):
         return str(self.product.name)
 
-    def save(self, force_insert=False, force_update=False, using=None,
-             update_fields=None, *args, **kwargs):
+    @property
+    def renditions(self):
+        return rendition_urls(self.image_hash)
+
+    def save(self, *args, **kwargs):
+        digest = hash_upload(self.image)
+        changed = digest is not None and digest != self.image_hash
+        if changed:
+            self.image_hash = digest
         super().save(*args, **kwargs)
 
-        img = Image.open(self.image.path)
-        if img.height > 500 or img.width > 500:
-            output_size = (500, 500)
-            img.thumbnail(output_size)
-            img.save(self.image.path)
-            # print(self.image.path)
+        if changed:
+            schedule_renditions(self.image, digest)
 
 
 class Label(Entity):
@@ -170,20 +304,24 @@ class Label(Entity):
 class Vendor(Entity):
     name = models.CharField('name', max_length=255)
     image = models.ImageField('image', upload_to='vendor/')
+    image_hash = models.CharField('image hash', max_length=64, blank=True, editable=False)
 
     def __str__(self):
         return self.name
 
-    def save(self, force_insert=False, force_update=False, using=None,
-             update_fields=None, *args, **kwargs):
+    @property
+    def renditions(self):
+        return rendition_urls(self.image_hash)
+
+    def save(self, *args, **kwargs):
+        digest = hash_upload(self.image)
+        changed = digest is not None and digest != self.image_hash
+        if changed:
+            self.image_hash = digest
         super().save(*args, **kwargs)
 
-        img = Image.open(self.image.path)
-        if img.height > 500 or img.width > 500:
-            output_size = (500, 500)
-            img.thumbnail(output_size)
-            img.save(self.image.path)
-            # print(self.image.path)
+        if changed:
+            schedule_renditions(self.image, digest)
 
 
 class City(Entity):
@@ -0,0 +1,97 @@
+import hashlib
+import threading
+import time
+
+from commerce.models import OrderStatus, City, Label, Merchant
+
+# how long another process may serve a table after it changed, signals only
+# reach the process that made the change
+TTL = 60
+
+
+class Snapshot:
+    """
+    Immutable copy of a table, every lookup is a dict access
+    """
+
+    def __init__(self, rows, name_field, default_field):
+        self.rows = rows
+        self.by_id = {row.pk: row for row in rows}
+        self.by_name = {getattr(row, name_field): row for row in rows}
+        self.default = next((row for row in rows if default_field and getattr(row, default_field)), None)
+        state = ''.join(f'{row.pk.hex}{row.updated.isoformat()}' for row in rows)
+        self.etag = '"%s"' % hashlib.sha1(state.encode()).hexdigest()
+        self.loaded = time.monotonic()
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+
+class Table:
+    """
+    In-process copy of a small table that rarely changes, loaded on first use
+    and dropped by the model's signals (see commerce.signals)
+    """
+
+    def __init__(self, model, name_field='name', default_field=None, ordering=('name',)):
+        self.model = model
+        self.name_field = name_field
+        self.default_field = default_field
+        self.ordering = ordering
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        The snapshot if it is loaded and fresh, None otherwise; never queries,
+        so it is safe to call from async code
+        """
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded > TTL:
+            return None
+        return snapshot
+
+    def snapshot(self):
+        snapshot = self.current()
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            snapshot = self.current()
+            if snapshot is None:
+                rows = list(self.model.objects.order_by(*self.ordering, 'id'))
+                snapshot = self._snapshot = Snapshot(rows, self.name_field, self.default_field)
+            return snapshot
+
+    def get(self, pk):
+        """
+        A miss looks up that one row: ids can come from the URL, so only a row
+        that does exist, created after the snapshot, drops the snapshot
+        """
+        row = self.snapshot().get(pk)
+        if row is None and pk is not None:
+            row = self.model.objects.filter(pk=pk).first()
+            if row is not None:
+                self.invalidate()
+        return row
+
+    def by_name(self, name):
+        return self.snapshot().by_name.get(name)
+
+    def default(self):
+        return self.snapshot().default
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+order_statuses = Table(OrderStatus, name_field='title', default_field='is_default', ordering=('title',))
+cities = Table(City)
+labels = Table(Label)
+merchants = Table(Merchant)
+
+TABLES = (order_statuses, cities, labels, merchants)
+
+
+def invalidate_all():
+    for table in TABLES:
+        table.invalidate()
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, features
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+SIZES = {
+    'thumbnail': (200, 200),
+    'medium': (500, 500),
+}
+
+FORMATS = {
+    'jpeg': 'JPEG',
+}
+if features.check('webp'):
+    FORMATS['webp'] = 'WEBP'
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_name(digest, size, extension):
+    return f'renditions/{digest}/{size}.{extension}'
+
+
+def rendition_urls(digest):
+    if not digest:
+        return {}
+    return {
+        size: {extension: default_storage.url(rendition_name(digest, size, extension)) for extension in FORMATS}
+        for size in SIZES
+    }
+
+
+def hash_upload(field_file):
+    """
+    sha256 of a file that was just uploaded, None when the field still holds
+    the file that is already stored
+    """
+    if not field_file or field_file._committed:
+        return None
+
+    digest = hashlib.sha256()
+    for chunk in field_file.chunks():
+        digest.update(chunk)
+    field_file.seek(0)
+    return digest.hexdigest()
+
+
+def render(source, target_dir, digest):
+    """
+    Runs in a worker process, writes every size in every format next to each other
+    and leaves the source untouched. Renditions that already exist are skipped.
+    """
+    with Image.open(source) as original:
+        original.load()
+        for size, box in SIZES.items():
+            image = original.copy()
+            image.thumbnail(box)
+            for extension, image_format in FORMATS.items():
+                target = os.path.join(target_dir, rendition_name(digest, size, extension))
+                if os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                converted = image.convert('RGB') if image_format == 'JPEG' and image.mode != 'RGB' else image
+                converted.save(target, image_format, quality=85)
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.RENDITION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _report_failure(future):
+    if future.exception():
+        logger.error('rendition failed', exc_info=future.exception())
+
+
+def schedule(field_file, digest):
+    """
+    Renders the renditions once the transaction that saved `field_file` commits,
+    in the process pool, or inline when RENDITION_WORKERS is 0
+    """
+    args = (field_file.path, settings.MEDIA_ROOT, digest)
+
+    def submit():
+        if settings.RENDITION_WORKERS:
+            executor().submit(render, *args).add_done_callback(_report_failure)
+        else:
+            render(*args)
+
+    transaction.on_commit(submit)
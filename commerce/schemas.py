@@ -1,7 +1,8 @@
-from typing import List
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Dict
 
 from ninja import ModelSchema, Schema
-from ninja.orm import create_schema
 from pydantic import UUID4
 
 from commerce.models import Product, Merchant
@@ -18,7 +19,8 @@ class UUIDSchema(Schema):
 
 class VendorOut(UUIDSchema):
     name: str
-    image: str
+    image: str = None
+    renditions: Dict[str, Dict[str, str]] = None
 
 
 class LabelOut(UUIDSchema):
@@ -31,10 +33,13 @@ class MerchantOut(ModelSchema):
         model_fields = ['id', 'name']
 
 
-class CategoryOut(UUIDSchema):
+class CategorySchema(UUIDSchema):
     name: str
     description: str
-    image: str
+    image: str = None
+
+
+class CategoryOut(CategorySchema):
     children: List['CategoryOut'] = None
 
 
@@ -42,10 +47,11 @@ CategoryOut.update_forward_refs()
 
 
 class ProductOut(ModelSchema):
-    vendor: VendorOut
-    label: LabelOut
-    merchant: MerchantOut
-    category: CategoryOut
+    # the relations are nullable, and so are the images without a file
+    vendor: VendorOut = None
+    label: LabelOut = None
+    merchant: MerchantOut = None
+    category: CategorySchema = None
 
     class Config:
         model = Product
@@ -63,6 +69,30 @@ class ProductOut(ModelSchema):
                         ]
 
 
+class FacetOut(UUIDSchema):
+    name: str
+    count: int
+
+
+class PriceFacetOut(Schema):
+    price_from: int
+    price_to: int = None
+    count: int
+
+
+class FacetsOut(Schema):
+    vendors: List[FacetOut]
+    categories: List[FacetOut]
+    prices: List[PriceFacetOut]
+
+
+class ProductPageOut(Schema):
+    items: List[ProductOut]
+    next_cursor: str = None
+    count: int = None
+    facets: FacetsOut = None
+
+
 # class ProductManualSchemaOut(Schema):
 #     pass
 
@@ -91,3 +121,33 @@ class ItemOut(UUIDSchema, ItemSchema):
     pass
 
 
+class CartItemOut(ItemOut):
+    line_total: Decimal
+
+
+class OrderLineOut(Schema):
+    product_id: UUID4
+    name: str
+    unit_price: Decimal
+    qty: int
+    line_total: Decimal
+
+
+class OrderOut(UUIDSchema):
+    ref_code: str
+    status: str
+    total: Decimal = None
+    note: str = None
+    created: datetime
+    lines: List[OrderLineOut]
+
+
+class OrderPageOut(Schema):
+    items: List[OrderOut]
+    next_cursor: str = None
+
+
+class CartOut(Schema):
+    items: List[CartItemOut]
+    subtotal: Decimal
+    item_count: int
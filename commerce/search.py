@@ -0,0 +1,111 @@
+import re
+
+from django.db import connections, router
+from django.db.models import F, Q, Value, FloatField
+
+from commerce.models import Product, ProductSearch
+
+TABLE = ProductSearch._meta.db_table
+PRODUCT_TABLE = Product._meta.db_table
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# The index is an FTS5 table whose rowid mirrors commerce_product.rowid, so a product
+# is re-indexed through the rowid b-tree instead of scanning the index, and product_id
+# (unindexed) is what the ORM joins on when searching.
+CREATE_SQL = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+    product_id UNINDEXED,
+    name,
+    description,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+'''
+
+DROP_SQL = f'DROP TABLE IF EXISTS {TABLE}'
+
+DELETE_SQL = f'DELETE FROM {TABLE} WHERE rowid = (SELECT rowid FROM {PRODUCT_TABLE} WHERE id = %s)'
+
+INSERT_SQL = f'''
+INSERT INTO {TABLE} (rowid, product_id, name, description)
+SELECT rowid, id, name, COALESCE(description, '') FROM {PRODUCT_TABLE}
+'''
+
+
+def is_supported(using):
+    return connections[using].vendor == 'sqlite'
+
+
+def _db_pk(product, using):
+    return Product._meta.pk.get_db_prep_value(product.pk, connections[using])
+
+
+def index_product(product, using=None):
+    using = using or router.db_for_write(Product)
+    if not is_supported(using):
+        return
+    pk = _db_pk(product, using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(DELETE_SQL, [pk])
+        cursor.execute(INSERT_SQL + ' WHERE id = %s', [pk])
+
+
+def index_products(product_ids, using=None):
+    """
+    index_product() for a batch, two statements whatever its size
+    """
+    using = using or router.db_for_write(Product)
+    if not is_supported(using) or not product_ids:
+        return
+    pks = [Product._meta.pk.get_db_prep_value(pk, connections[using]) for pk in product_ids]
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN '
+                       f'(SELECT rowid FROM {PRODUCT_TABLE} WHERE id IN ({placeholders}))', pks)
+        cursor.execute(INSERT_SQL + f' WHERE id IN ({placeholders})', pks)
+
+
+def unindex_product(product, using=None):
+    using = using or router.db_for_write(Product)
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(DELETE_SQL, [_db_pk(product, using)])
+
+
+def rebuild_index(using=None):
+    using = using or router.db_for_write(Product)
+    if not is_supported(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+        cursor.execute(INSERT_SQL)
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT COUNT(*) FROM {TABLE}')
+        return cursor.fetchone()[0]
+
+
+def match_expression(q):
+    """
+    "red sho" -> '"red"* "sho"*', every term must match, each as a prefix
+    """
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(q))
+
+
+def search_products(queryset, q):
+    """
+    Narrows `queryset` to products matching `q` and annotates their bm25 `rank`
+    (lower is better). Databases without FTS5 fall back to a substring filter.
+    """
+    expression = match_expression(q)
+    if not expression:
+        # still annotated, callers order by rank
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+
+    if not is_supported(queryset.db):
+        return queryset.filter(
+            Q(name__icontains=q) | Q(description__icontains=q)
+        ).annotate(rank=Value(0.0, output_field=FloatField()))
+
+    return queryset.filter(search__document__match=expression).annotate(rank=F('search__rank'))
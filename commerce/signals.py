@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from commerce import registry, search
+from commerce.cache import bump_catalog_version
+from commerce.models import Product, Vendor, Category, Label, Merchant
+
+CATALOG_MODELS = (Product, Vendor, Category, Label, Merchant)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    search.index_product(instance, using=using)
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    search.unindex_product(instance, using=using)
+
+
+def catalog_changed(sender, using, **kwargs):
+    # after commit, otherwise a concurrent read could cache the old rows under the new version
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_changed_save_{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_changed_delete_{model.__name__}')
+
+
+def reference_data_changed(sender, using, **kwargs):
+    table = REFERENCE_TABLES[sender]
+    # dropped now for this transaction, and again once every thread can see the change
+    table.invalidate()
+    transaction.on_commit(table.invalidate, using=using)
+
+
+REFERENCE_TABLES = {table.model: table for table in registry.TABLES}
+
+for model in REFERENCE_TABLES:
+    post_save.connect(reference_data_changed, sender=model, dispatch_uid=f'reference_changed_save_{model.__name__}')
+    post_delete.connect(reference_data_changed, sender=model, dispatch_uid=f'reference_changed_delete_{model.__name__}')
@@ -0,0 +1,106 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, DecimalField
+from django.utils import timezone
+
+from commerce import registry
+from commerce.cache import stock_changed
+from commerce.models import Product, Reservation, Order, OrderStatus
+
+QTY_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(id=product_id, then=Value(qty)) for product_id, qty in quantities.items()],
+        output_field=QTY_FIELD,
+    )
+
+
+def reserve(order, quantities):
+    """
+    Takes `quantities` ({product_id: qty}) off Product.qty with a single conditional
+    UPDATE ... WHERE qty >= n. Only rows with enough stock are touched, so when the
+    updated count falls short the caller must roll the transaction back.
+    Returns False in that case. A quantity below 1 raises ValueError, taking
+    it off would add to the stock.
+    """
+    if any(qty <= 0 for qty in quantities.values()):
+        raise ValueError('Quantities must be positive')
+
+    needed = _per_product(quantities)
+    # `updated` moves with the stock, so the listing ETags do too
+    reserved = Product.objects.filter(id__in=quantities, qty__gte=needed).update(
+        qty=F('qty') - needed, updated=timezone.now(),
+    )
+    if reserved != len(quantities):
+        return False
+
+    expires = timezone.now() + settings.STOCK_RESERVATION_TTL
+    Reservation.objects.bulk_create([
+        Reservation(order=order, product_id=product_id, qty=qty, expires=expires)
+        for product_id, qty in quantities.items()
+    ])
+    transaction.on_commit(lambda: stock_changed(quantities))
+    return True
+
+
+def _status(title):
+    status = registry.order_statuses.by_name(title)
+    if status is None:
+        status, _ = OrderStatus.objects.get_or_create(title=title, defaults={'is_default': False})
+    return status
+
+
+def _move(order_id, source, target):
+    """
+    Conditional UPDATE of the order's status, so of a sweep and a payment
+    racing for the same NEW order only one wins
+    """
+    return Order.objects.filter(id=order_id, status=source).update(status=target, updated=timezone.now()) == 1
+
+
+def confirm(order_id):
+    """
+    Moves a NEW order to PROCESSING, its reserved stock is consumed. Returns
+    False if the order is not NEW anymore, e.g. cancelled by release_expired()
+    """
+    return _move(order_id, _status(OrderStatus.NEW), _status(OrderStatus.PROCESSING))
+
+
+def release_expired(batch_size=500, now=None):
+    """
+    Sweeps orders with expired reservations in batches. Orders still NEW are
+    cancelled and their stock goes back to the products, holds of orders that
+    moved on are consumed and just dropped.
+    """
+    now = now or timezone.now()
+    new, cancelled = _status(OrderStatus.NEW), _status(OrderStatus.CANCELLED)
+    released = 0
+    while True:
+        with transaction.atomic():
+            # whole orders, their holds are restocked together or not at all
+            order_ids = list(
+                Reservation.objects.filter(expires__lte=now).order_by()
+                .values_list('order_id', flat=True).distinct()[:batch_size]
+            )
+            if not order_ids:
+                break
+
+            cancelled_ids = [order_id for order_id in order_ids if _move(order_id, new, cancelled)]
+            restock = defaultdict(int)
+            for product_id, qty in Reservation.objects.filter(order_id__in=cancelled_ids).values_list(
+                    'product_id', 'qty'):
+                restock[product_id] += qty
+
+            if restock:
+                Product.objects.filter(id__in=restock).update(
+                    qty=F('qty') + _per_product(restock), updated=timezone.now(),
+                )
+                transaction.on_commit(lambda restock=restock: stock_changed(restock))
+
+            released += Reservation.objects.filter(order_id__in=order_ids).delete()[0]
+
+    return released
@@ -1,3 +1,1109 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, date, timezone
+from decimal import Decimal
+from typing import List
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, router
+from django.db.models import QuerySet
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now as timezone_now
+from django.utils.translation import gettext_lazy
+from ninja.responses import NinjaJSONEncoder
+
+from account.authorization import get_tokens_for_user
+from account.models import User
+from commerce import cache as catalog_cache, importer, registry, renditions, search, stock
+from commerce.cart import open_items, merge_anonymous_cart, MAX_ITEM_QTY
+from commerce.models import Product, ProductImage, Vendor, Category, Label, Merchant, Item, Order, OrderStatus, City
+from commerce.schemas import ProductOut, ProductPageOut
+from config.asgi import application
+from config.utils import metrics
+from config.utils.renderers import dumps
+from config.utils.responses import render_json, cached_conditional_response
+from config.utils.routers import request_scope, cache_timeout
+from config.utils.storage import ContentAddressedStorage, serve_media
+
+FULL_SCAN = re.compile(r'^SCAN (\S+)(?: AS \S+)?$')
+
+
+# async views run their queries on this thread, where the test transaction is
+@override_settings(ORM_WORKERS=0)
+class QueryPlanTestCase(TestCase):
+    def setUp(self):
+        # catalog responses are cached, a hit would not run any query
+        cache.clear()
+        # reference tables are read whole, once per process rather than per request
+        for table in registry.TABLES:
+            table.snapshot()
+
+    def assertNoFullScan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        scans = [detail for detail in plan if FULL_SCAN.match(detail)]
+        self.assertFalse(scans, f'full table scan in:\n{sql}\n' + '\n'.join(plan))
+
+    def assertEndpointUsesIndexes(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url, params)
+
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertTrue(selects, f'no queries for {url} {params}')
+        for sql in selects:
+            self.assertNoFullScan(sql)
+
+
+class ListProductsQueryPlanTest(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+        cls.category = category = Category.objects.create(
+            name='category', description='', image='category/category.png', is_active=True
+        )
+        label = Label.objects.create(name='label')
+        merchant = Merchant.objects.create(name='merchant')
+        OrderStatus.objects.create(title=OrderStatus.NEW, is_default=True)
+        Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=1, cost=1, price=10, discounted_price=i, vendor=cls.vendor,
+                    category=category, label=label, merchant=merchant, is_featured=False, is_active=True)
+            for i in range(10)
+        ])
+
+    def test_filter_combinations_use_indexes(self):
+        filters = {
+            'q': 'product',
+            'price_from': 2,
+            'price_to': 8,
+            'vendor': self.vendor.id,
+            'category': self.category.id,
+        }
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                params = {name: filters[name] for name in names}
+                with self.subTest(**params):
+                    self.assertEndpointUsesIndexes('/api/products', params)
+
+    def test_trusted_listing_renders_like_product_out(self):
+        no_image = Vendor.objects.bulk_create([Vendor(name='no image', image='')])[0]
+        Product.objects.bulk_create([
+            Product(name=f'bare {i}', qty=1, cost=1, price=10, discounted_price=1, vendor=vendor,
+                    is_featured=False, is_active=True)
+            for i, vendor in enumerate((None, no_image))
+        ])
+
+        page = self.client.get('/api/products', {'limit': 4}).json()
+
+        products = Product.objects.select_related('vendor', 'category', 'label', 'merchant')
+        expected = render_json(List[ProductOut], list(products.order_by('-created', '-id')[:4]))
+        self.assertEqual(page['items'], json.loads(expected))
+        self.assertEqual({product['name'] for product in page['items'][:2]}, {'bare 0', 'bare 1'})
+        # the trusted rows still match the documented schema
+        ProductPageOut.parse_obj(page)
+
+    def test_facets_cost_one_query_per_filter(self):
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get('/api/products', {'price_from': 2, 'limit': 3})
+        cache.clear()
+        with CaptureQueriesContext(connection) as faceted:
+            page = self.client.get('/api/products', {'price_from': 2, 'limit': 3, 'facets': True}).json()
+
+        self.assertEqual(len(faceted), len(plain) + 1)
+        self.assertEqual(page['facets'], {
+            'vendors': [{'id': str(self.vendor.id), 'name': 'vendor', 'count': 8}],
+            'categories': [{'id': str(self.category.id), 'name': 'category', 'count': 8}],
+            'prices': [{'price_from': 0, 'price_to': 50, 'count': 8}],
+        })
+
+        # the next page reuses the facets of the filter
+        with CaptureQueriesContext(connection) as next_page:
+            response = self.client.get('/api/products', {'price_from': 2, 'limit': 3, 'facets': True,
+                                                         'cursor': page['next_cursor']})
+        self.assertEqual(response.json()['facets'], page['facets'])
+        self.assertEqual(len(next_page), len(plain))
+
+    def test_checkout_only_drops_pages_holding_its_products(self):
+        user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+        product = Product.objects.get(discounted_price=9)
+        Item.objects.create(user=user, product=product, item_qty=1)
+        cheap, dear = {'price_to': 3}, {'price_from': 5}
+        for params in (cheap, dear):
+            self.client.get('/api/products', params)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/orders/create-order',
+                             HTTP_AUTHORIZATION='Bearer ' + get_tokens_for_user(user)['access'])
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/products', cheap)
+        page = self.client.get('/api/products', dear).json()
+        self.assertEqual(next(item['qty'] for item in page['items'] if item['id'] == str(product.id)), '0.00')
+
+
+class ExportProductsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+        category = Category.objects.create(name='category', description='', image='category/c.png', is_active=True)
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=1, cost=1, price=10, discounted_price=i, vendor=vendor,
+                    category=category, is_featured=False, is_active=i != 2)
+            for i in range(4)
+        ])
+
+    def test_active_products_one_per_line(self):
+        response = self.client.get('/api/products/export', {'chunk_size': 1})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(line['name'] for line in lines), ['product 0', 'product 1', 'product 3'])
+        self.assertEqual(lines[0]['vendor']['name'], 'vendor')
+        self.assertIsNone(lines[0]['label'])
+
+    async def test_refused_over_asgi(self):
+        response = await AsyncClient().get('/api/products/export')
+
+        self.assertEqual(response.status_code, 501)
+
+
+@override_settings(ORM_WORKERS=0)
+class CategoryTreeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def category(name, parent=None, is_active=True):
+            return Category.objects.create(name=name, parent=parent, description='', image='category/c.png',
+                                           is_active=is_active)
+
+        cls.root = category('root')
+        cls.shoes = category('shoes', cls.root)
+        cls.bags = category('bags', cls.root)
+        cls.boots = category('boots', cls.shoes)
+        hidden = category('hidden', cls.root, is_active=False)
+        category('under hidden', hidden)
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=1, cost=1, price=10, discounted_price=1, category=category,
+                    is_featured=False, is_active=True)
+            for i, category in enumerate((cls.boots, cls.bags))
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, params):
+        response = self.client.get('/api/products', params)
+        return sorted(product['name'] for product in response.json()['items'])
+
+    def test_tree_skips_inactive_branches(self):
+        tree = self.client.get('/api/products/categories').json()
+
+        def shape(nodes):
+            return [(node['name'], shape(node['children'])) for node in nodes]
+
+        self.assertEqual(shape(tree), [('root', [('bags', []), ('shoes', [('boots', [])])])])
+
+    def test_move_rewrites_the_descendant_paths(self):
+        self.shoes.parent = self.bags
+        self.shoes.save()
+
+        boots = Category.objects.get(id=self.boots.id)
+        self.assertEqual(boots.path, f'{self.root.id.hex}/{self.bags.id.hex}/{self.shoes.id.hex}/{boots.id.hex}/')
+        self.assertEqual(boots.depth, 3)
+        self.assertEqual(self.names({'category': self.bags.id}), ['product 0', 'product 1'])
+
+        self.root.parent = boots
+        with self.assertRaises(ValueError):
+            self.root.save()
+
+    def test_filter_covers_the_subtree(self):
+        self.assertEqual(self.names({'category': self.root.id}), ['product 0', 'product 1'])
+        self.assertEqual(self.names({'category': self.shoes.id}), ['product 0'])
+        self.assertEqual(self.client.get('/api/products', {'category': uuid.uuid4()}).status_code, 404)
+        self.assertEqual(self.client.get('/api/products', {'category': 'abc'}).status_code, 422)
+        self.assertEqual(self.client.get('/api/products', {'vendor': 'abc'}).status_code, 422)
+
+
+@override_settings(ORM_WORKERS=0)
+class CatalogCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+        cls.category = Category.objects.create(name='category', description='', image='category/c.png',
+                                               is_active=True)
+        cls.label = Label.objects.create(name='label')
+        cls.merchant = Merchant.objects.create(name='merchant')
+        cls.product = Product.objects.create(
+            name='product', qty=1, cost=1, price=10, discounted_price=1, vendor=cls.vendor, category=cls.category,
+            label=cls.label, merchant=cls.merchant, is_featured=False, is_active=True,
+        )
+
+    def setUp(self):
+        cache.clear()
+        for table in registry.TABLES:
+            table.snapshot()
+
+    def test_served_from_cache_until_the_catalog_changes(self):
+        for instance in (self.product, self.vendor, self.category, self.label, self.merchant):
+            with self.subTest(model=type(instance).__name__):
+                self.client.get('/api/products')
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get('/api/products').status_code, 200)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    instance.save()
+
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.client.get('/api/products').status_code, 200)
+                self.assertTrue(queries, 'served from the cache after a change')
+
+    def test_per_process_cache_expires_with_the_registry(self):
+        # the other workers never see a version bump made in this one
+        self.assertEqual(settings.CACHES['default']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(catalog_cache.TIMEOUT, registry.TTL)
+
+
+@override_settings(ORM_WORKERS=0)
+class ConditionalResponseTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+        Product.objects.create(name='product', qty=1, cost=1, price=10, discounted_price=1, vendor=vendor,
+                               is_featured=False, is_active=True)
+        cls.city = City.objects.create(name='city')
+
+    def setUp(self):
+        cache.clear()
+        registry.invalidate_all()
+
+    @contextmanager
+    def assertNotSerialized(self):
+        serialized = mock.Mock(side_effect=AssertionError('serialized for a 304'))
+        with mock.patch('config.utils.responses.dumps', serialized), \
+                mock.patch('config.utils.renderers.dumps', serialized):
+            yield
+
+    def assertNotModified(self, url):
+        with self.assertNotSerialized():
+            # nothing cached yet, the ETag comes from the database
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+        etag = self.client.get(url)['ETag']
+        with self.assertNotSerialized():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_products(self):
+        self.assertNotModified('/api/products')
+
+    def test_vendors(self):
+        self.assertNotModified('/api/vendors')
+
+    def test_cities(self):
+        self.assertNotModified('/api/addresses/cities')
+
+    def test_city(self):
+        self.assertNotModified(f'/api/addresses/cities/{self.city.id}')
+
+
+@override_settings(ORM_WORKERS=0)
+class ProductPaginationTest(TestCase):
+    BAD_CURSORS = ([1, 2], [[1], 'x'], [{'a': 1}, 2], [True, 'zz'], [None, None], ['x', 'y'], {'a': 1}, [1])
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=1, cost=1, price=10, discounted_price=1,
+                    is_featured=False, is_active=True)
+            for i in range(7)
+        ])
+        # ties on created, the id has to break them
+        Product.objects.filter(name__in=['product 2', 'product 3', 'product 4']).update(
+            created=datetime(2021, 1, 1, tzinfo=timezone.utc)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_next_cursor_walks_every_product_once(self):
+        names, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get('/api/products', params).json()
+            names += [product['name'] for product in page['items']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        expected = Product.objects.order_by('-created', '-id').values_list('name', flat=True)
+        self.assertEqual(names, list(expected))
+        self.assertEqual(len(set(names)), 7)
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        for values in self.BAD_CURSORS:
+            with self.subTest(values=values):
+                response = self.client.get('/api/products', {'cursor': encode_cursor_raw(values)})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/products', {'cursor': '!!'}).status_code, 400)
+
+
+def encode_cursor_raw(values):
+    """
+    A cursor holding `values` as they are, like a client could craft it
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+@override_settings(ORM_WORKERS=0)
+class SearchTest(TestCase):
+    def create(self, name, description=''):
+        return Product.objects.create(name=name, description=description, qty=1, cost=1, price=10,
+                                      discounted_price=1, is_featured=False, is_active=True)
+
+    def search(self, q):
+        return list(search.search_products(Product.objects.all(), q).order_by('rank', 'id')
+                    .values_list('name', flat=True))
+
+    def test_every_term_matches_as_a_prefix(self):
+        self.create('red leather shoe')
+        self.create('red cotton shirt')
+        self.create('blue shoe')
+
+        self.assertEqual(self.search('red sho'), ['red leather shoe'])
+        self.assertEqual(sorted(self.search('sh')), ['blue shoe', 'red cotton shirt', 'red leather shoe'])
+        self.assertEqual(self.search('!!'), [])
+        self.assertEqual(self.client.get('/api/products', {'q': '!!'}).status_code, 404)
+
+    def test_ordered_by_bm25(self):
+        self.create('lamp', 'a lamp for the desk, the bedroom, the kitchen, the garden and the garage')
+        self.create('lamp lamp', 'lamp')
+
+        self.assertEqual(self.search('lamp'), ['lamp lamp', 'lamp'])
+
+    def test_index_follows_saves_and_deletes(self):
+        product = self.create('green bag')
+        product.name = 'green watch'
+        product.save()
+
+        self.assertEqual(self.search('bag'), [])
+        self.assertEqual(self.search('watch'), ['green watch'])
+
+        product.delete()
+        self.assertEqual(self.search('watch'), [])
+
+    def test_rebuild_search_index(self):
+        # bulk inserts skip the signals, so they are not indexed
+        Product.objects.bulk_create([
+            Product(name=f'summer dress {i}', qty=1, cost=1, price=10, discounted_price=1, is_featured=False,
+                    is_active=True)
+            for i in range(3)
+        ])
+        self.assertEqual(self.search('dress'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+
+        self.assertEqual(len(self.search('dress')), 3)
+        self.assertIn('Indexed 3 products', out.getvalue())
+
+
+class ContentAddressedStorageTest(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = ContentAddressedStorage(location=self.root)
+
+    def test_same_bytes_same_name_one_write(self):
+        with mock.patch.object(self.storage, '_save', wraps=self.storage._save) as save:
+            first = self.storage.save('vendor/logo.PNG', ContentFile(b'logo'))
+            second = self.storage.save('vendor/other.png', ContentFile(b'logo'))
+            third = self.storage.save('vendor/logo.png', ContentFile(b'new logo'))
+
+        digest = hashlib.sha256(b'logo').hexdigest()
+        self.assertEqual(first, f'vendor/{digest[:2]}/{digest}.png')
+        self.assertEqual(second, first)
+        self.assertNotEqual(third, first)
+        self.assertEqual(save.call_count, 2)
+
+    def test_content_addressed_files_are_immutable(self):
+        name = self.storage.save('vendor/logo.png', ContentFile(b'logo'))
+        with open(os.path.join(self.root, 'plain.png'), 'wb') as f:
+            f.write(b'plain')
+        request = RequestFactory().get('/media/')
+
+        response = serve_media(request, name, document_root=self.root)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        response = serve_media(request, 'plain.png', document_root=self.root)
+        self.assertNotIn('Cache-Control', response)
+
+
+@override_settings(RENDITION_WORKERS=0, ORM_WORKERS=0)
+class RenditionTest(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        media = override_settings(MEDIA_ROOT=root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.root = root
+        cache.clear()
+
+    def png(self, color='red', size=(800, 600)):
+        out = io.BytesIO()
+        Image.new('RGB', size, color).save(out, 'PNG')
+        return out.getvalue()
+
+    def save(self, instance, content=None):
+        if content is not None:
+            instance.image = ContentFile(content, name='upload.png')
+        with mock.patch.object(renditions, 'render', wraps=renditions.render) as render, \
+                self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+        return render.call_count
+
+    def test_every_size_and_format_once_the_transaction_commits(self):
+        content = self.png()
+        vendor = Vendor(name='vendor', image=ContentFile(content, name='logo.png'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            vendor.save()
+            self.assertFalse(os.path.exists(os.path.join(self.root, 'renditions')))
+        for callback in callbacks:
+            callback()
+
+        for size, box in renditions.SIZES.items():
+            for extension, image_format in renditions.FORMATS.items():
+                with self.subTest(size=size, extension=extension):
+                    path = os.path.join(self.root, renditions.rendition_name(vendor.image_hash, size, extension))
+                    with Image.open(path) as image:
+                        self.assertEqual(image.format, image_format)
+                        self.assertLessEqual(image.size, box)
+        with vendor.image.open('rb') as original:
+            self.assertEqual(original.read(), content)
+
+    def test_unchanged_file_is_not_rendered_again(self):
+        content = self.png()
+        product = Product.objects.create(name='product', qty=1, cost=1, price=10, discounted_price=1,
+                                         is_featured=False, is_active=True)
+        image = ProductImage(product=product, is_default_image=True)
+
+        self.assertEqual(self.save(image, content), 1)
+        self.assertEqual(self.save(image), 0)
+        self.assertEqual(self.save(image, content), 0)
+        self.assertEqual(self.save(image, self.png('blue')), 1)
+
+    def test_vendor_out_exposes_the_renditions(self):
+        vendor = Vendor(name='vendor')
+        self.save(vendor, self.png())
+
+        listed = self.client.get('/api/vendors').json()[0]
+
+        self.assertEqual(listed['renditions'], renditions.rendition_urls(vendor.image_hash))
+        self.assertEqual(set(listed['renditions']), set(renditions.SIZES))
+        self.assertTrue(listed['renditions']['thumbnail']['jpeg'].endswith(
+            f'/renditions/{vendor.image_hash}/thumbnail.jpeg'
+        ))
+
+
+class RendererTest(SimpleTestCase):
+    def test_same_output_as_ninja_encoder(self):
+        values = [
+            Decimal('10.50'), uuid.uuid4(), date(2021, 11, 2), gettext_lazy('text'),
+            datetime(2021, 11, 2, 10, 30, 15, 123456, tzinfo=timezone.utc), datetime(2021, 11, 2, 10, 30),
+        ]
+        self.assertEqual(json.loads(dumps(values)), json.loads(json.dumps(values, cls=NinjaJSONEncoder)))
+
+
+class CreateOrderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        OrderStatus.objects.create(title=OrderStatus.NEW, is_default=True)
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=100, cost=1, price=10, discounted_price=i + 1,
+                    is_featured=False, is_active=True)
+            for i in range(10)
+        ])
+
+    def setUp(self):
+        self.user = User.objects.create_user('first', 'last', f'user{User.objects.count()}@example.com', 'password')
+        self.headers = {'HTTP_AUTHORIZATION': 'Bearer ' + get_tokens_for_user(self.user)['access']}
+        registry.order_statuses.snapshot()
+
+    def fill_cart(self, size):
+        Item.objects.bulk_create([
+            Item(user=self.user, product=product, item_qty=2) for product in self.products[:size]
+        ])
+
+    def create_order(self):
+        return self.client.post('/api/orders/create-order', **self.headers)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        for size in (1, 10):
+            with self.subTest(size=size):
+                self.setUp()
+                self.fill_cart(size)
+                with self.assertNumQueries(8):
+                    response = self.create_order()
+                self.assertEqual(response.status_code, 200)
+
+    def test_total_and_items(self):
+        self.fill_cart(3)
+        self.create_order()
+
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.total, (1 + 2 + 3) * 2)
+        self.assertEqual(order.items.count(), 3)
+        self.assertFalse(Item.objects.filter(user=self.user, ordered=False).exists())
+
+    def test_stock_is_reserved(self):
+        self.fill_cart(2)
+        self.create_order()
+
+        stock = Product.objects.filter(id__in=[p.id for p in self.products[:2]]).values_list('qty', flat=True)
+        self.assertEqual(list(stock), [98, 98])
+        self.assertEqual(Order.objects.get(user=self.user).reservations.count(), 2)
+
+    def test_out_of_stock_rolls_back(self):
+        self.fill_cart(2)
+        Product.objects.filter(id=self.products[1].id).update(qty=1)
+
+        self.assertEqual(self.create_order().status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.products[0].id).qty, 100)
+        self.assertEqual(Item.objects.filter(user=self.user, ordered=False).count(), 2)
+
+    def test_lines_ordered_concurrently_roll_back(self):
+        self.fill_cart(2)
+        reserve = stock.reserve
+
+        def reserve_then_lose_the_race(order, quantities):
+            reserved = reserve(order, quantities)
+            # another checkout of the same cart commits in the meantime
+            Item.objects.filter(user=self.user).update(ordered=True)
+            return reserved
+
+        with mock.patch.object(stock, 'reserve', reserve_then_lose_the_race):
+            self.assertEqual(self.create_order().status_code, 400)
+
+        self.assertFalse(Order.objects.exists())
+        stock_left = Product.objects.filter(id__in=[p.id for p in self.products[:2]]).values_list('qty', flat=True)
+        self.assertEqual(list(stock_left), [100, 100])
+
+    def test_non_positive_quantity_is_rejected(self):
+        Item.objects.bulk_create([Item(user=self.user, product=self.products[0], item_qty=-5)])
+
+        self.assertEqual(self.create_order().status_code, 400)
+        self.assertEqual(Product.objects.get(id=self.products[0].id).qty, 100)
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart(self):
+        self.assertEqual(self.create_order().status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class ReleaseExpiredTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.new = OrderStatus.objects.create(title=OrderStatus.NEW, is_default=True)
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=10, cost=1, price=10, discounted_price=1, is_featured=False,
+                    is_active=True)
+            for i in range(2)
+        ])
+        cls.user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+
+    def setUp(self):
+        registry.invalidate_all()
+
+    def place_order(self, qty=5):
+        order = Order.objects.create(user=self.user, status=self.new, ref_code='ref', ordered=False)
+        self.assertTrue(stock.reserve(order, {product.id: qty for product in self.products}))
+        return order
+
+    def stock_left(self):
+        return list(Product.objects.order_by('name').values_list('qty', flat=True))
+
+    def release(self):
+        return stock.release_expired(now=timezone_now() + settings.STOCK_RESERVATION_TTL)
+
+    def status(self, order):
+        return Order.objects.get(id=order.id).status.title
+
+    def test_unpaid_order_is_cancelled_and_restocked(self):
+        order = self.place_order()
+        self.assertEqual(self.stock_left(), [5, 5])
+
+        self.assertEqual(stock.release_expired(), 0)
+        self.assertEqual(self.release(), 2)
+
+        self.assertEqual(self.stock_left(), [10, 10])
+        self.assertEqual(self.status(order), OrderStatus.CANCELLED)
+        self.assertFalse(order.reservations.exists())
+        # too late to pay for it
+        self.assertFalse(stock.confirm(order.id))
+        self.assertEqual(self.status(order), OrderStatus.CANCELLED)
+
+    def test_paid_order_keeps_its_stock(self):
+        order = self.place_order()
+        self.assertTrue(stock.confirm(order.id))
+
+        self.assertEqual(self.release(), 2)
+
+        self.assertEqual(self.stock_left(), [5, 5])
+        self.assertEqual(self.status(order), OrderStatus.PROCESSING)
+
+    def test_order_paid_during_the_sweep_keeps_its_stock(self):
+        order = self.place_order()
+        move = stock._move
+
+        def paid_first(*args):
+            # another process confirms the payment between the read and the update
+            with mock.patch.object(stock, '_move', move):
+                stock.confirm(order.id)
+            return move(*args)
+
+        with mock.patch.object(stock, '_move', paid_first):
+            self.release()
+
+        self.assertEqual(self.stock_left(), [5, 5])
+        self.assertEqual(self.status(order), OrderStatus.PROCESSING)
+
+    def test_command_sweeps_in_batches(self):
+        orders = [self.place_order(qty=2) for _ in range(3)]
+
+        out = io.StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=timezone_now() + settings.STOCK_RESERVATION_TTL):
+            call_command('release_expired_reservations', '--batch-size', '1', stdout=out)
+
+        self.assertIn('Released 6 reservations', out.getvalue())
+        self.assertEqual(self.stock_left(), [10, 10])
+        self.assertEqual({self.status(order) for order in orders}, {OrderStatus.CANCELLED})
+
+
+class ViewCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+        category = Category.objects.create(name='category', description='', image='category/c.png', is_active=True)
+        label = Label.objects.create(name='label')
+        merchant = Merchant.objects.create(name='merchant')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=100, cost=1, price=10, discounted_price=i + 1, vendor=vendor,
+                    category=category, label=label, merchant=merchant, is_featured=False, is_active=True)
+            for i in range(10)
+        ])
+        cls.user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+        cls.headers = {'HTTP_AUTHORIZATION': 'Bearer ' + get_tokens_for_user(cls.user)['access']}
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        for size in (1, 10):
+            with self.subTest(size=size):
+                Item.objects.filter(user=self.user).delete()
+                Item.objects.bulk_create([
+                    Item(user=self.user, product=product, item_qty=2) for product in self.products[:size]
+                ])
+                with self.assertNumQueries(2):
+                    response = self.client.get('/api/orders/cart', **self.headers)
+
+                cart = response.json()
+                self.assertEqual(len(cart['items']), size)
+                self.assertEqual(cart['item_count'], size * 2)
+                self.assertEqual(float(cart['subtotal']), sum(range(1, size + 1)) * 2)
+
+    def test_other_users_cart_is_not_visible(self):
+        other = User.objects.create_user('first', 'last', 'other@example.com', 'password')
+        Item.objects.create(user=other, product=self.products[0], item_qty=1)
+
+        self.assertEqual(self.client.get('/api/orders/cart', **self.headers).status_code, 404)
+
+
+class AddToCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='product', qty=100, cost=1, price=10, discounted_price=10,
+                                             is_featured=False, is_active=True)
+        cls.user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+        cls.headers = {'HTTP_AUTHORIZATION': 'Bearer ' + get_tokens_for_user(cls.user)['access']}
+
+    def add_to_cart(self, qty):
+        return self.client.post('/api/orders/add-to-cart', {'product_id': str(self.product.id), 'item_qty': qty},
+                                content_type='application/json', **self.headers)
+
+    def test_quantity_is_added_to_the_open_line(self):
+        Item.objects.create(user=self.user, product=self.product, item_qty=5, ordered=True)
+
+        self.assertEqual(self.add_to_cart(2).status_code, 200)
+        self.assertEqual(self.add_to_cart(3).status_code, 200)
+
+        self.assertEqual(list(open_items(self.user.id).values_list('item_qty', flat=True)), [5])
+        # lines already ordered are history
+        self.assertEqual(Item.objects.get(user=self.user, ordered=True).item_qty, 5)
+
+    def test_line_created_concurrently_is_incremented(self):
+        Item.objects.create(user=self.user, product=self.product, item_qty=1)
+        update = QuerySet.update
+        calls = []
+
+        def update_missing_the_line(queryset, **kwargs):
+            # the first update runs before the other request inserted the line
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update_missing_the_line):
+            self.assertEqual(self.add_to_cart(2).status_code, 200)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(open_items(self.user.id).values_list('item_qty', flat=True)), [3])
+
+    def test_quantity_out_of_range_is_rejected(self):
+        for qty in (-5, 0, MAX_ITEM_QTY + 1):
+            with self.subTest(qty=qty):
+                self.assertEqual(self.add_to_cart(qty).status_code, 400)
+        self.assertFalse(Item.objects.exists())
+
+    def test_inactive_or_missing_product_is_not_added(self):
+        Product.objects.filter(id=self.product.id).update(is_active=False)
+        self.assertEqual(self.add_to_cart(1).status_code, 404)
+
+        response = self.client.post('/api/orders/add-to-cart', {'product_id': str(uuid.uuid4()), 'item_qty': 1},
+                                    content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Item.objects.exists())
+
+
+class AnonymousCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+        category = Category.objects.create(name='category', description='', image='category/c.png', is_active=True)
+        label = Label.objects.create(name='label')
+        merchant = Merchant.objects.create(name='merchant')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=100, cost=1, price=10, discounted_price=i + 1, vendor=vendor,
+                    category=category, label=label, merchant=merchant, is_featured=False, is_active=True)
+            for i in range(3)
+        ])
+        cls.user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+
+    def add_to_cart(self, product, qty=1):
+        return self.client.post('/api/orders/add-to-cart', {'product_id': str(product.id), 'item_qty': qty},
+                                content_type='application/json')
+
+    def test_guest_cart_does_not_write(self):
+        with self.assertNumQueries(1):
+            self.add_to_cart(self.products[0], 2)
+        self.add_to_cart(self.products[1])
+        self.add_to_cart(self.products[0])
+
+        self.assertFalse(Item.objects.exists())
+        cart = self.client.get('/api/orders/cart').json()
+        self.assertEqual(cart['item_count'], 4)
+        self.assertEqual(float(cart['subtotal']), 1 * 3 + 2 * 1)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.add_to_cart(self.products[0])
+        self.client.cookies['cart'] = self.client.cookies['cart'].value[:-1] + 'x'
+
+        self.assertEqual(self.client.get('/api/orders/cart').status_code, 404)
+
+    def test_merged_on_signin(self):
+        Item.objects.create(user=self.user, product=self.products[0], item_qty=1)
+        self.add_to_cart(self.products[0], 2)
+        self.add_to_cart(self.products[1], 3)
+
+        response = self.client.post('/api/auth/signin', {'email': 'user@example.com', 'password': 'password'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies['cart'].value, '')
+        quantities = dict(open_items(self.user.id).values_list('product_id', 'item_qty'))
+        self.assertEqual(quantities, {self.products[0].id: 3, self.products[1].id: 3})
+
+    def test_merge_increments_a_line_added_concurrently(self):
+        before = Item.objects.create(user=self.user, product=self.products[0], item_qty=1).updated
+        update = QuerySet.update
+        calls = []
+
+        def update_missing_the_line(queryset, **kwargs):
+            # the merge reads no line, then a concurrent add-to-cart inserts it
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update_missing_the_line):
+            merge_anonymous_cart(self.user.id, {self.products[0].id.hex: 2})
+
+        line = open_items(self.user.id).get()
+        self.assertEqual(line.item_qty, 3)
+        self.assertGreater(line.updated, before)
+
+
+@override_settings(ORM_WORKERS=0)
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+
+    def test_server_timing_and_histograms(self):
+        City.objects.create(name='city')
+
+        response = self.client.get('/api/addresses/cities')
+
+        db, serialize, total = response['Server-Timing'].split(', ')
+        self.assertTrue(db.startswith('db;dur=') and db.endswith('desc="1 queries"'), db)
+        self.assertTrue(serialize.startswith('serialize;dur='))
+        self.assertTrue(total.startswith('total;dur='))
+
+        exposed = self.client.get('/metrics').content.decode()
+        self.assertIn('http_request_db_queries_bucket{operation="list_cities",le="1"} 1', exposed)
+        self.assertIn('http_request_duration_seconds_count{operation="list_cities"} 1', exposed)
+        self.assertIn('auth_token_cache_size', exposed)
+
+    def test_metrics_are_only_served_to_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+
+        with override_settings(METRICS_ALLOWED_IPS=['203.0.113.7']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class AsgiConcurrencyTest(SimpleTestCase):
+    DELAY = .5
+
+    def slow_snapshot(self):
+        time.sleep(self.DELAY)
+        return registry.Snapshot([City(name='city', updated=datetime.now(timezone.utc))], 'name', None)
+
+    async def get(self, path):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+            'headers': [(b'host', b'testserver')],
+        })
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(timeout=10)
+        await communicator.receive_output(timeout=10)
+        return start['status']
+
+    async def test_async_views_are_not_serialized_by_middleware(self):
+        # the view waits on the ORM pool, a sync middleware would hold every request on one thread
+        with mock.patch.object(registry.cities, 'current', return_value=None), \
+                mock.patch.object(registry.cities, 'snapshot', self.slow_snapshot):
+            started = time.perf_counter()
+            statuses = await asyncio.gather(*[self.get('/api/addresses/cities') for _ in range(4)])
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(statuses, [200] * 4)
+        self.assertLess(elapsed, self.DELAY * 3)
+
+
+class ImportProductsTest(TestCase):
+    FEED = (
+        'sku,name,qty,cost,price,discounted_price,vendor,label,is_active\n'
+        'A1,red shirt,5,1,10,8,vendor,new label,true\n'
+        'A2,blue shoe,5,1,10,9,vendor,,1\n'
+        'A3,green bag,5,1,10,9,unknown vendor,,1\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = Vendor.objects.bulk_create([Vendor(name='vendor', image='vendor/vendor.png')])[0]
+
+    def import_feed(self, feed, fmt='csv'):
+        return importer.import_products(importer.read_rows(io.StringIO(feed), fmt), batch_size=2)
+
+    def test_create_then_update_on_sku(self):
+        result = self.import_feed(self.FEED)
+
+        self.assertEqual((result.created, result.updated), (2, 0))
+        self.assertEqual(result.errors, [(4, 'unknown vendor "unknown vendor"')])
+        shirt = Product.objects.get(sku='A1')
+        self.assertEqual((shirt.vendor, shirt.label.name, shirt.is_featured), (self.vendor, 'new label', False))
+
+        result = self.import_feed('{"sku": "A1", "price": "12.50"}\n{"sku": "A2", "name": "blue boot"}\n', 'jsonl')
+
+        self.assertEqual((result.created, result.updated), (0, 2))
+        shirt.refresh_from_db()
+        self.assertEqual((shirt.name, shirt.price, shirt.discounted_price), ('red shirt', Decimal('12.50'), 8))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(
+            list(search.search_products(Product.objects.all(), 'boot').values_list('sku', flat=True)), ['A2']
+        )
+
+    def test_numbers_the_database_cannot_store_are_skipped(self):
+        feed = ''.join(
+            f'{{"sku": "B{i}", "name": "bag", "qty": {qty}, "cost": 1, "price": {price}, "discounted_price": 1}}\n'
+            for i, (qty, price) in enumerate([
+                ('"1e20"', '"9.999"'), ('5', '"Infinity"'), ('"NaN"', '1'), ('99999999.99', '"1.005"'),
+            ])
+        )
+        result = self.import_feed(feed, 'jsonl')
+
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors, [
+            (1, '"1e20" is out of range'), (2, '"Infinity" is not a number'), (3, '"NaN" is not a number'),
+        ])
+        bag = Product.objects.get(sku='B3')
+        self.assertEqual((bag.qty, bag.price), (Decimal('99999999.99'), Decimal('1.00')))
+
+    def test_only_the_first_errors_are_kept(self):
+        feed = '{"sku": ""}\n' * 50
+        result = importer.import_products(importer.read_rows(io.StringIO(feed), 'jsonl'), max_errors=3)
+
+        self.assertEqual(result.skipped, 50)
+        self.assertEqual(result.errors, [(line, 'missing sku') for line in (1, 2, 3)])
+
+
+class ListOrdersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        OrderStatus.objects.create(title=OrderStatus.NEW, is_default=True)
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'product {i}', qty=100, cost=1, price=10, discounted_price=i + 1,
+                    is_featured=False, is_active=True)
+            for i in range(3)
+        ])
+        cls.user = User.objects.create_user('first', 'last', 'user@example.com', 'password')
+        cls.headers = {'HTTP_AUTHORIZATION': 'Bearer ' + get_tokens_for_user(cls.user)['access']}
+
+    def place_order(self, *products):
+        Item.objects.bulk_create([Item(user=self.user, product=product, item_qty=2) for product in products])
+        self.client.post('/api/orders/create-order', **self.headers)
+
+    def test_history_is_frozen_at_order_time(self):
+        self.place_order(*self.products[:2])
+        Product.objects.filter(id=self.products[0].id).update(name='renamed', discounted_price=99)
+
+        orders = self.client.get('/api/orders', **self.headers).json()['items']
+
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(float(orders[0]['total']), (1 + 2) * 2)
+        self.assertEqual(orders[0]['status'], OrderStatus.NEW)
+        self.assertEqual(
+            [(line['name'], float(line['unit_price']), line['qty']) for line in orders[0]['lines']],
+            [('product 0', 1, 2), ('product 1', 2, 2)],
+        )
+
+    def test_one_query_per_page(self):
+        for product in self.products:
+            self.place_order(product)
+
+        with self.assertNumQueries(1):
+            page = self.client.get('/api/orders', {'limit': 2}, **self.headers).json()
+        self.assertEqual([order['lines'][0]['name'] for order in page['items']], ['product 2', 'product 1'])
+
+        with self.assertNumQueries(1):
+            page = self.client.get('/api/orders', {'limit': 2, 'cursor': page['next_cursor']}, **self.headers).json()
+        self.assertEqual([order['lines'][0]['name'] for order in page['items']], ['product 0'])
+        self.assertIsNone(page['next_cursor'])
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        for values in ProductPaginationTest.BAD_CURSORS:
+            with self.subTest(values=values):
+                response = self.client.get('/api/orders', {'cursor': encode_cursor_raw(values)}, **self.headers)
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ORM_WORKERS=0)
+class RegistryTest(TestCase):
+    def test_lookups_do_not_query_and_saves_invalidate(self):
+        City.objects.create(name='baghdad')
+        registry.cities.snapshot()
+
+        with self.assertNumQueries(0):
+            cities = self.client.get('/api/addresses/cities').json()
+        self.assertEqual([city['name'] for city in cities], ['baghdad'])
+
+        City.objects.create(name='basra')
+        cities = self.client.get('/api/addresses/cities').json()
+        self.assertEqual([city['name'] for city in cities], ['baghdad', 'basra'])
+
+    def test_unknown_id_is_looked_up_without_reloading(self):
+        snapshot = registry.labels.snapshot()
+        label = Label.objects.bulk_create([Label(name='label')])[0]
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(registry.labels.get(uuid.uuid4()))
+        self.assertIs(registry.labels.snapshot(), snapshot)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(registry.labels.get(label.id), label)
+        # the next lookups find it in a fresh snapshot
+        self.assertEqual(registry.labels.get(label.id), label)
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.labels.get(label.id), label)
+
+    def test_city_created_elsewhere_is_found(self):
+        registry.cities.snapshot()
+        # no signal, like a city saved by another process
+        city = City.objects.bulk_create([City(name='erbil')])[0]
+
+        response = self.client.get(f'/api/addresses/cities/{city.id}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'erbil')
+        self.assertEqual(self.client.get(f'/api/addresses/cities/{uuid.uuid4()}').status_code, 404)
+
+    def test_unknown_city_ids_keep_the_table_cached(self):
+        City.objects.create(name='baghdad')
+        registry.cities.snapshot()
+
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                self.client.get(f'/api/addresses/cities/{uuid.uuid4()}')
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/addresses/cities')
+
+
+# outside of TestCase's transaction, where every read would stay on the primary
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    def test_catalog_reads_go_to_the_replica_until_a_write(self):
+        with request_scope():
+            self.assertEqual(Product.objects.all().db, 'replica')
+            self.assertEqual(City.objects.all().db, 'replica')
+            self.assertEqual(Item.objects.all().db, 'default')
+
+            router.db_for_write(Item)
+
+            self.assertEqual(Product.objects.all().db, 'default')
+
+        with request_scope():
+            self.assertEqual(Product.objects.all().db, 'replica')
+
+    def test_primary_outside_of_requests(self):
+        self.assertEqual(Product.objects.all().db, 'default')
+
+    def test_what_was_read_from_a_replica_is_cached_briefly(self):
+        self.assertEqual(cache_timeout(900), 900)
+        with request_scope():
+            self.assertEqual(cache_timeout(900), 900)
+            router.db_for_read(Product)
+            self.assertEqual(cache_timeout(900), settings.REPLICA_CACHE_TIMEOUT)
+
+        with request_scope(), mock.patch.object(cache, 'set') as cache_set, \
+                mock.patch('config.utils.responses.queryset_etag', return_value='"etag"'):
+            router.db_for_read(Product)
+            cached_conditional_response(RequestFactory().get('/'), 'key', Product.objects.all(), lambda: '{}', 900)
+        self.assertEqual(cache_set.call_args[0][2], settings.REPLICA_CACHE_TIMEOUT)
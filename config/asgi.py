@@ -13,4 +13,5 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+# GET /api/products/export streams from the ORM and is only served over WSGI
 application = get_asgi_application()
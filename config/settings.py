@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.utils.metrics.MetricsMiddleware',
+    'config.utils.routers.ReplicaRouterMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,9 +80,57 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # keep connections across requests, the PRAGMAs below run once per connection
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 600)),
     }
 }
 
+# Read replicas of the catalog, e.g. REPLICA_DB_NAMES=/srv/replica1.sqlite3,/srv/replica2.sqlite3
+# (kept up to date by the platform, or locally by `manage.py sync_replicas`), see
+# config.utils.routers.ReplicaRouter
+REPLICA_DATABASES = []
+for index, name in enumerate(filter(None, os.environ.get('REPLICA_DB_NAMES', '').split(',')), 1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica{index}')
+# seconds a response rendered from a replica stays cached, about the replication lag
+REPLICA_CACHE_TIMEOUT = int(os.environ.get('REPLICA_CACHE_TIMEOUT', 5))
+
+DATABASE_ROUTERS = ['config.utils.routers.ReplicaRouter']
+
+# Applied to every SQLite connection by config.utils.sqlite. WAL lets readers run
+# while a writer commits, writers wait up to busy_timeout ms for each other
+# instead of failing with "database is locked". SQLITE_TUNING=off keeps the defaults.
+SQLITE_PRAGMAS = {} if os.environ.get('SQLITE_TUNING') == 'off' else {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the catalog cache is invalidated by bumping a version key, only a shared backend
+# lets every process see the bump: run more than one worker with
+# MEMCACHED_LOCATION=127.0.0.1:11211. The per-process default keeps catalog
+# entries no longer than the registry does (see commerce.cache.TIMEOUT)
+
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'commerce',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -118,9 +169,26 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# uploads are named after their content, identical files are stored once
+# and can be cached forever (see config.utils.storage.serve_media)
+DEFAULT_FILE_STORAGE = 'config.utils.storage.ContentAddressedStorage'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'account.User'
+
+# How long stock stays reserved for an order that has not moved past NEW
+STOCK_RESERVATION_TTL = timedelta(minutes=15)
+
+# Worker processes rendering image renditions off the request, 0 renders inline
+RENDITION_WORKERS = 2
+
+# Addresses allowed to scrape /metrics (config.utils.metrics.metrics_view), matched on
+# REMOTE_ADDR, e.g. METRICS_ALLOWED_IPS=10.0.0.5,10.0.0.6 for the Prometheus servers
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Threads running the ORM work of async views (config.utils.executor), 0 runs it
+# on Django's single thread-sensitive executor
+ORM_WORKERS = int(os.environ.get('ORM_WORKERS', 8))
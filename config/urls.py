@@ -21,8 +21,11 @@ from ninja import NinjaAPI
 from account.controllers import account_controller
 from commerce.controllers import products_controller, address_controller, vendor_controller, order_controller
 from config import settings
+from config.utils.metrics import metrics_view
+from config.utils.renderers import FastJSONRenderer
+from config.utils.storage import serve_media
 
-api = NinjaAPI()
+api = NinjaAPI(renderer=FastJSONRenderer())
 
 api.add_router('products', products_controller)
 api.add_router('addresses', address_controller)
@@ -33,9 +36,10 @@ api.add_router('auth', account_controller)
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api.urls),
+    path('metrics', metrics_view),
 
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
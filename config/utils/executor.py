@@ -0,0 +1,48 @@
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def orm_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ORM_WORKERS, thread_name_prefix='orm')
+        return _executor
+
+
+def _with_connections(func):
+    """
+    Worker threads live outside the request cycle, so they expire their
+    connections the way request_started/request_finished would
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Awaits blocking (ORM) work from an async view. The work runs on a pool of
+    ORM_WORKERS threads, so at most that many queries are in flight and extra
+    calls queue instead of each getting a thread. With ORM_WORKERS = 0 it falls
+    back to Django's default, one thread shared with the sync code.
+    """
+    if not settings.ORM_WORKERS:
+        return await sync_to_async(func)(*args, **kwargs)
+    return await sync_to_async(_with_connections(func), thread_sensitive=False,
+                               executor=orm_executor())(*args, **kwargs)
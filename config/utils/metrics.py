@@ -0,0 +1,199 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+from config.utils.middleware import SyncAsyncMiddleware
+
+SECONDS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'serialize_time', 'elapsed')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.elapsed = 0.0
+
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram, one series per label value
+    """
+
+    def __init__(self, name, help, buckets, label='operation'):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {label_value: (list(counts), total) for label_value, (counts, total) in self._series.items()}
+
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Wall time until the response is returned',
+                             SECONDS_BUCKETS)
+DB_DURATION = Histogram('http_request_db_duration_seconds', 'Time spent in SQL per request', SECONDS_BUCKETS)
+DB_QUERIES = Histogram('http_request_db_queries', 'SQL queries per request', QUERY_BUCKETS)
+SERIALIZE_DURATION = Histogram('http_request_serialize_duration_seconds', 'Time spent rendering JSON per request',
+                               SECONDS_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, DB_DURATION, DB_QUERIES, SERIALIZE_DURATION)
+
+# callables returning [(name, type, help, value)], see register_collector()
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    execute_wrapper installed on every connection, a no-op outside of a request
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid='config.utils.metrics')
+
+
+@contextmanager
+def timed_serialization():
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += time.perf_counter() - started
+
+
+def operation_name(request):
+    """
+    Name of the Ninja operation that handled `request`, its view name for other
+    views, kept to a bounded set so it can be used as a label
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+
+    path_view = getattr(match.func, '__self__', None)
+    for operation in getattr(path_view, 'operations', ()):
+        if request.method in operation.methods:
+            return operation.view_func.__name__
+    return match.view_name or match.route
+
+
+class MetricsMiddleware(SyncAsyncMiddleware):
+    """
+    Times every request and adds a Server-Timing header. Streaming responses
+    are timed until their first byte is ready.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # connections opened before this module was imported missed connection_created
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+
+    @contextmanager
+    def scope(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            _current.reset(token)
+            metrics.elapsed = time.perf_counter() - started
+
+    def process_response(self, request, response, metrics):
+        operation = operation_name(request)
+        REQUEST_DURATION.observe(operation, metrics.elapsed)
+        DB_DURATION.observe(operation, metrics.db_time)
+        DB_QUERIES.observe(operation, metrics.queries)
+        SERIALIZE_DURATION.observe(operation, metrics.serialize_time)
+
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries"',
+            f'serialize;dur={metrics.serialize_time * 1000:.2f}',
+            f'total;dur={metrics.elapsed * 1000:.2f}',
+        ))
+        return response
+
+
+def expose():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.expose()
+    for collector in _collectors:
+        for name, metric_type, help, value in collector():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape target, only served to settings.METRICS_ALLOWED_IPS
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(expose(), content_type=PROMETHEUS_CONTENT_TYPE)
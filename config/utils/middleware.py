@@ -0,0 +1,40 @@
+import asyncio
+from contextlib import nullcontext
+
+
+class SyncAsyncMiddleware:
+    """
+    Base of middleware that runs get_response() inside scope() and passes the
+    response to process_response(). Sync and async capable, so it does not
+    force ASGI requests through the thread of sync middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # marks the instance as a coroutine function for Django, like MiddlewareMixin does
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with self.scope(request) as state:
+            response = self.get_response(request)
+        return self.process_response(request, response, state)
+
+    async def __acall__(self, request):
+        with self.scope(request) as state:
+            response = await self.get_response(request)
+        return self.process_response(request, response, state)
+
+    def scope(self, request):
+        """
+        Context manager the response is produced in, what it yields is handed
+        to process_response()
+        """
+        return nullcontext()
+
+    def process_response(self, request, response, state):
+        return response
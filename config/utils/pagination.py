@@ -0,0 +1,106 @@
+import base64
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+COUNT_TIMEOUT = 60 * 5
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        # full microsecond precision, a truncated timestamp would skip rows
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_dump_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    # only what encode_cursor() writes, anything else would reach the lookups
+    if not isinstance(values, list) or not all(_is_scalar(value) for value in values):
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _after(ordering, values):
+    """
+    Builds the keyset condition for "rows that come after `values`", e.g. for
+    ('-created', '-id'): created < c OR (created = c AND id < i)
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def paginate(queryset, *, cursor=None, limit=DEFAULT_LIMIT, ordering=('-created', '-id')):
+    """
+    Keyset (cursor) pagination, the cost of a page does not depend on how deep it is.
+    The last field of `ordering` must be unique so the order is total.
+    """
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor('Invalid cursor')
+        try:
+            queryset = queryset.filter(_after(ordering, values))
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor('Invalid cursor')
+
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        # model instances or .values() rows
+        get = last.get if isinstance(last, dict) else lambda name: getattr(last, name)
+        next_cursor = encode_cursor([get(field.lstrip('-')) for field in ordering])
+
+    return {
+        'items': items,
+        'next_cursor': next_cursor,
+    }
+
+
+def cached_count(queryset, timeout=COUNT_TIMEOUT):
+    """
+    Approximate total for a filtered queryset, cached per SQL statement
+    so the COUNT(*) runs at most once every `timeout` seconds.
+    """
+    key = 'count:' + hashlib.sha1(str(queryset.order_by().query).encode()).hexdigest()
+    return cache.get_or_set(key, queryset.count, timeout)
@@ -0,0 +1,60 @@
+import json
+import uuid
+from datetime import datetime, date
+from decimal import Decimal
+
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+from config.utils.metrics import timed_serialization
+
+
+def _datetime(value):
+    # the same format as DjangoJSONEncoder: milliseconds, "Z" for UTC
+    text = value.isoformat()
+    if value.microsecond:
+        text = text[:23] + text[26:]
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return text
+
+
+# exact type -> encoder, one dict lookup instead of NinjaJSONEncoder's chain of isinstance()
+ENCODERS = {
+    Decimal: str,
+    uuid.UUID: str,
+    datetime: _datetime,
+    date: date.isoformat,
+}
+
+_fallback = NinjaJSONEncoder()
+
+
+def json_default(value):
+    """
+    `default` for json.dumps(): the types ORM rows are made of go through
+    ENCODERS, anything else (pydantic models, subclasses, lazy strings...)
+    through NinjaJSONEncoder, so the output is the same as Ninja's
+    """
+    encoder = ENCODERS.get(type(value))
+    if encoder is None:
+        return _fallback.default(value)
+    return encoder(value)
+
+
+encoder = json.JSONEncoder(default=json_default, separators=(',', ':'))
+
+
+def dumps(data):
+    return encoder.encode(data)
+
+
+class FastJSONRenderer(BaseRenderer):
+    """
+    Ninja renderer built on dumps(), reporting its time to the request's metrics
+    """
+    media_type = 'application/json'
+
+    def render(self, request, data, *, response_status):
+        with timed_serialization():
+            return dumps(data)
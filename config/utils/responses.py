@@ -0,0 +1,103 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from pydantic import parse_obj_as
+
+from config.utils.metrics import timed_serialization
+from config.utils.renderers import dumps
+from config.utils.routers import cache_timeout
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+def render_json(schema, data):
+    """
+    Validates `data` against `schema` and renders it the same way a Ninja
+    operation would, so the result can be cached and replayed as is.
+    """
+    with timed_serialization():
+        return dumps(parse_obj_as(schema, data))
+
+
+def render_trusted(data):
+    """
+    render_json() without the validation, for hot reads that build the response
+    shape straight from ORM rows: the database already guarantees the types.
+    """
+    with timed_serialization():
+        return dumps(data)
+
+
+def json_response(content, status=200, etag=None):
+    response = HttpResponse(content, status=status, content_type=JSON_CONTENT_TYPE)
+    if etag:
+        response['ETag'] = etag
+    return response
+
+
+def queryset_etag(queryset, *parts):
+    """
+    Strong ETag from the last `updated` timestamp and the row count,
+    one aggregate query that does not load any row.
+    """
+    state = queryset.order_by().aggregate(last_updated=Max('updated'), count=Count('pk'))
+    raw = json.dumps([state['last_updated'], state['count'], *parts], default=str)
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+def conditional_response(request, etag, render):
+    """
+    Answers 304 when the client already has `etag`, otherwise calls `render`.
+    `render` returns the JSON content, or any other view result (e.g. an error tuple)
+    that is passed through untouched.
+    """
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in etags or '*' in etags:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    content = render()
+    if not isinstance(content, str):
+        return content
+    return json_response(content, etag=etag)
+
+
+def cached_response(request, key, is_stale=None):
+    """
+    The response cached by cached_conditional_response() under `key`, None on a
+    miss or when `is_stale(dependencies)` finds the cached entry out of date
+    """
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    etag, content, dependencies = cached
+    if is_stale is not None and is_stale(dependencies):
+        return None
+    return conditional_response(request, etag, lambda: content)
+
+
+def cached_conditional_response(request, key, queryset, render, timeout, is_stale=None, dependencies=None):
+    """
+    conditional_response() whose content and ETag are cached together under `key`,
+    a cache hit costs no query at all. `dependencies()`, called once rendered,
+    is cached along and handed to `is_stale` on every hit. Content read from a
+    replica is only kept for a few seconds, see routers.cache_timeout().
+    """
+    response = cached_response(request, key, is_stale)
+    if response is not None:
+        return response
+
+    etag = queryset_etag(queryset, key)
+
+    def render_and_cache():
+        content = render()
+        if isinstance(content, str):
+            cache.set(key, (etag, content, dependencies() if dependencies else None), cache_timeout(timeout))
+        return content
+
+    return conditional_response(request, etag, render_and_cache)
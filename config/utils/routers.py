@@ -0,0 +1,100 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from config.utils.middleware import SyncAsyncMiddleware
+
+# catalog and reference tables, read far more often than they are written
+REPLICATED_MODELS = {
+    'commerce.product',
+    'commerce.productsearch',
+    'commerce.productimage',
+    'commerce.vendor',
+    'commerce.category',
+    'commerce.city',
+    'commerce.label',
+    'commerce.merchant',
+}
+
+# a mutable state per request rather than a flag, so a write made on an ORM
+# thread (config.utils.executor) pins the reads of the whole request
+_request = contextvars.ContextVar('db_request', default=None)
+
+
+class RequestState:
+    __slots__ = ('pinned', 'replica_reads')
+
+    def __init__(self):
+        self.pinned = False
+        self.replica_reads = False
+
+
+@contextmanager
+def request_scope():
+    token = _request.set(RequestState())
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def cache_timeout(timeout):
+    """
+    `timeout` for caching what the current request rendered, capped to
+    settings.REPLICA_CACHE_TIMEOUT when it read from a replica: a replica may
+    lag behind a write whose cache invalidation already happened
+    """
+    state = _request.get()
+    if state is not None and state.replica_reads:
+        return min(timeout, settings.REPLICA_CACHE_TIMEOUT)
+    return timeout
+
+
+class ReplicaRouter:
+    """
+    Sends reads of REPLICATED_MODELS made while serving a request to one of
+    settings.REPLICA_DATABASES. Everything else uses the primary: writes, other
+    models, reads inside a transaction, reads after the request wrote anything
+    (so users see their own writes), and code running outside a request, like
+    management commands.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _request.get()
+        if state is None or state.pinned or not settings.REPLICA_DATABASES:
+            return None
+        if model._meta.label_lower not in REPLICATED_MODELS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        state.replica_reads = True
+        return random.choice(settings.REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state.pinned = True
+        # explicit, otherwise an instance read from a replica would be saved back there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are copies of the primary, see `manage.py sync_replicas`
+        return True
+
+
+class ReplicaRouterMiddleware(SyncAsyncMiddleware):
+    """
+    Runs every request in its own request_scope()
+    """
+
+    def scope(self, request):
+        return request_scope()
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    Runs settings.SQLITE_PRAGMAS on every new SQLite connection, on the raw
+    connection so they are not logged or counted as queries
+    """
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+connection_created.connect(apply_pragmas, dispatch_uid='config.utils.sqlite')
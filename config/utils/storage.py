@@ -0,0 +1,48 @@
+import hashlib
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.views.static import serve
+
+CONTENT_ADDRESSED = re.compile(r'(^|/)[0-9a-f]{64}(/|\.|$)')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores a file under the sha256 of its bytes, 'vendor/logo.png' becomes
+    'vendor/ab/ab12...ef.png'. Saving bytes that are already stored writes nothing
+    and returns the existing name, so a file never changes once it has a name.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, digest[:2], digest + extension)
+
+        if self.exists(name):
+            return name
+        return self._save(name, content)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve, content-addressed files get far-future immutable caching
+    """
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if response.status_code == 200 and CONTENT_ADDRESSED.search(path):
+        response['Cache-Control'] = IMMUTABLE
+    return response